@@ -1,6 +1,8 @@
 import os
+import hmac
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from urllib.parse import parse_qs, unquote
 from flask import Flask, request, abort, render_template, jsonify, make_response
@@ -8,6 +10,9 @@ from werkzeug.utils import secure_filename
 import line_bot_logic
 import sheets_handler
 import drive_handler
+import ttl_cache
+import webhook_queue
+import write_journal
 
 # 設定圖片上傳路徑
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -17,9 +22,103 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 
+def conditional_json(payload, max_age=60):
+    """
+    以內容雜湊作為 ETag 回傳 JSON：
+    用戶端帶 If-None-Match 且內容未變時回 304，不必重新下載。
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if max_age == 0:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+# LIFF 頁面資料來源平行讀取：每個來源的時間上限 (秒)，逾時則該區塊以空資料呈現
+PAGE_SOURCE_TIMEOUT = float(os.getenv('PAGE_SOURCE_TIMEOUT', 3))
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS', 8))
+_page_pool = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix="page-source")
+
+# 與使用者無關的頁面，渲染結果跨使用者共用
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 60))
+_page_cache = ttl_cache.LRUCache(maxsize=32, ttl=PAGE_CACHE_TTL)
+# 頁面 -> 所依賴的資料快取；資料快取更新 (version 改變) 後頁面快取自然失效
+PAGE_DEPENDENCIES = {
+    "class_info.html": ("classes",),
+    "fix_report.html": ("settings",),
+    "checkin.html": ("categories",),
+}
+
+
+def fetch_page_sources(sources):
+    """
+    平行讀取頁面所需的資料：sources 為 {名稱: (函式, 預設值)}。
+    所有來源共用同一個時間上限，逾時或失敗的來源回傳預設值。
+    回傳 (結果, 是否全部成功)
+    """
+    futures = {name: _page_pool.submit(fn) for name, (fn, _) in sources.items()}
+    wait(futures.values(), timeout=PAGE_SOURCE_TIMEOUT)
+    results, complete = {}, True
+    for name, future in futures.items():
+        default = sources[name][1]
+        if not future.done():
+            print(f"⚠️ 頁面資料 [{name}] 逾時，以空資料呈現")
+            results[name], complete = default, False
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"⚠️ 頁面資料 [{name}] 讀取失敗: {e}")
+            results[name], complete = default, False
+    return results, complete
+
+
+def page_cache_key(template_name):
+    versions = []
+    for name in PAGE_DEPENDENCIES.get(template_name, ()):
+        cache = ttl_cache.get_cache(name)
+        if cache:
+            # 其他 worker 要求重新載入時先同步，頁面快取才不會沿用舊資料
+            cache.sync()
+        versions.append(cache.version if cache else 0)
+    return (template_name, tuple(versions))
+
+
+def is_admin_request(data=None):
+    """以「系統參數設定」的 API_KEY 驗證管理請求 (X-Api-Key 標頭或 api_key 參數)"""
+    api_key = request.headers.get('X-Api-Key') or (data or {}).get('api_key') or request.args.get('api_key')
+    config, _ = sheets_handler.get_system_settings()
+    expected = config.get('API_KEY')
+    return bool(expected and api_key and hmac.compare_digest(str(api_key), str(expected)))
+
+
+def report_folder_name(item_name):
+    return f"{datetime.now().strftime('%Y%m%d')}_{item_name}"
+
+
+def make_unique_filename(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if not ext: ext = ".jpg"
+    return f"{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
+
+
 def create_app():
     app = Flask(__name__)
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # 上傳大小上限；超過 500KB 的上傳 Werkzeug 會直接寫入暫存檔，不佔記憶體
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 30)) * 1024 * 1024
+    # 啟動時就開始同步寫入日誌：上次當機 / 重啟前留下的資料不必等到下一筆新資料才送出
+    write_journal.start()
+    # 背景寫回臨時任務認領數 (包括其他 worker 結束前留下、尚未寫回的認領)
+    sheets_handler.start_task_reconciler()
+
+    @app.errorhandler(413)
+    def request_too_large(e):
+        # 以 JSON 回應，前端才能顯示原因 (預設是 HTML 錯誤頁)
+        limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+        return jsonify({'success': False, 'error': f"上傳檔案超過 {limit_mb}MB 上限"}), 413
 
     @app.route("/callback", methods=['POST'])
     def callback():
@@ -30,8 +129,8 @@ def create_app():
         except Exception as e:
             print(f"解析 Webhook 失敗: {e}")
             abort(400)
-        for event in events:
-            line_bot_logic.handle_event(event)
+        # 交給背景 worker 處理，立即回 200 避免 LINE 逾時重送
+        webhook_queue.submit(events, line_bot_logic.handle_event)
         return 'OK'
 
     # --- LIFF 頁面路由 ---
@@ -60,58 +159,40 @@ def create_app():
                 print(f"⚠️ 解析 liff.state 失敗: {e}")
 
         template_context = {"liff_id": liff_id}
+        # 資料來源 {名稱: (函式, 逾時或失敗時的預設值)}，平行讀取
+        sources = {}
+        # 含個人資料的頁面不共用快取
+        personal = False
 
         if page == 'class_info':
             template_name = "class_info.html"
-            try:
-                buttons = sheets_handler.get_button_config()
-                classes = sheets_handler.get_upcoming_classes()
-                template_context["ssr_buttons"] = buttons
-                template_context["ssr_classes"] = classes
-            except Exception as e:
-                template_context["ssr_buttons"] = []
-                template_context["ssr_classes"] = []
+            sources["ssr_buttons"] = (sheets_handler.get_button_config, [])
+            sources["ssr_classes"] = (sheets_handler.get_upcoming_classes, [])
 
         elif page == 'query_result':
             template_name = "query_result.html"
-            try:
-                options = sheets_handler.get_class_result_links()
-                template_context["options"] = options
-            except Exception as e:
-                template_context["options"] = []
+            sources["options"] = (sheets_handler.get_class_result_links, [])
 
         elif page == 'fix':
             template_name = "fix_report.html"
-            try:
+            def fix_locations():
                 config, locations = sheets_handler.get_system_settings()
-                template_context["locations"] = [loc['name'] for loc in locations if loc.get('name')]
-            except:
-                template_context["locations"] = []
+                return [loc['name'] for loc in locations if loc.get('name')]
+            sources["locations"] = (fix_locations, [])
+            # 前端依此將照片分批上傳，每次請求不超過上限
+            template_context["max_upload_bytes"] = app.config['MAX_CONTENT_LENGTH']
 
         elif page == 'query':
             template_name = "data_query.html"
             template_context["ssr_data"] = None
             template_context["ssr_percent"] = 0
             if user_id_param:
-                try:
-                    user_data = sheets_handler.get_dashboard_data(user_id_param)
-                    if "error" not in user_data:
-                        template_context["ssr_data"] = user_data
-                        if user_data.get('target', 0) > 0:
-                            pct = int((user_data['actual'] / user_data['target']) * 100)
-                            if pct > 100: pct = 100
-                        else:
-                            pct = 0
-                        template_context["ssr_percent"] = pct
-                except Exception as e:
-                    pass
+                personal = True
+                sources["ssr_data"] = (lambda: sheets_handler.get_dashboard_data(user_id_param), None)
 
         elif page == 'checkin':
             template_name = "checkin.html"
-            try:
-                template_context["categories"] = sheets_handler.get_all_categories()
-            except:
-                template_context["categories"] = []
+            sources["categories"] = (sheets_handler.get_all_categories, [])
 
         elif page == 'class_center':
             template_name = "class_center.html"
@@ -127,18 +208,41 @@ def create_app():
         else:
             template_name = "index.html"
 
-        response = make_response(render_template(template_name, **template_context))
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-        return response
+        html = None if personal else _page_cache.get(page_cache_key(template_name))
+        if html is None:
+            results, complete = fetch_page_sources(sources)
+            template_context.update(results)
+            if page == 'query':
+                user_data = template_context["ssr_data"]
+                if not user_data or "error" in user_data:
+                    template_context["ssr_data"] = None
+                elif user_data.get('target', 0) > 0:
+                    pct = int((user_data['actual'] / user_data['target']) * 100)
+                    template_context["ssr_percent"] = min(pct, 100)
+            html = render_template(template_name, **template_context)
+            # 有來源逾時的頁面不快取，下次請求再重新讀取
+            if complete and not personal:
+                _page_cache.set(page_cache_key(template_name), html)
+
+        response = make_response(html)
+        if personal:
+            response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+            response.headers["Pragma"] = "no-cache"
+            response.headers["Expires"] = "0"
+            return response
+        # 共用頁面：每次向伺服器確認，內容未變時回 304
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
 
     # --- API ---
     @app.route("/api/classes")
     def api_get_classes():
         try:
-            classes = sheets_handler.get_upcoming_classes()
-            return jsonify(classes)
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', type=int)
+            classes = sheets_handler.get_upcoming_classes(max(offset, 0), limit)
+            return conditional_json(classes)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -146,7 +250,7 @@ def create_app():
     def api_get_buttons():
         try:
             buttons = sheets_handler.get_button_config()
-            return jsonify(buttons)
+            return conditional_json(buttons, max_age=300)
         except Exception as e:
             return jsonify([]), 500
 
@@ -174,15 +278,13 @@ def create_app():
     def get_categories_api():
         try:
             categories = sheets_handler.get_all_categories()
-            return jsonify(categories)
+            return conditional_json(categories, max_age=300)
         except Exception as e:
             return jsonify([]), 500
 
     @app.route("/api/create_folder", methods=['POST'])
     def api_create_folder():
-        item_name = request.json.get('item_name', '未命名設備')
-        date_str = datetime.now().strftime("%Y%m%d")
-        folder_name = f"{date_str}_{item_name}"
+        folder_name = report_folder_name(request.json.get('item_name', '未命名設備'))
 
         try:
             config, _ = sheets_handler.get_system_settings()
@@ -263,7 +365,8 @@ def create_app():
 
     @app.route("/api/public_tasks")
     def api_public():
-        return jsonify(sheets_handler.get_public_tasks())
+        # 人數隨時變動，每次都需驗證 ETag
+        return conditional_json(sheets_handler.get_public_tasks(), max_age=0)
 
     @app.route("/api/claim_public_task", methods=['POST'])
     def api_claim():
@@ -311,9 +414,7 @@ def create_app():
             return jsonify({'error': '未選擇檔案'}), 400
 
         if file:
-            ext = os.path.splitext(file.filename)[1].lower()
-            if not ext: ext = ".jpg"
-            unique_filename = f"{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
+            unique_filename = make_unique_filename(file.filename)
 
             try:
                 image_url = drive_handler.upload_file_to_drive(
@@ -330,6 +431,68 @@ def create_app():
                 print(f"上傳 Google Drive 失敗: {e}")
                 return jsonify({'error': f"上傳失敗: {str(e)}"}), 500
 
+    @app.route("/api/upload_batch", methods=['POST'])
+    def upload_batch():
+        """
+        一次上傳多張照片：建立資料夾後平行壓縮、上傳，回傳所有連結。
+        照片總量超過請求上限時，前端會分批呼叫；之後的批次帶第一批回傳的 folder_id，傳進同一個資料夾
+        """
+        files = [f for f in request.files.getlist('files') if f and f.filename]
+        if not files:
+            return jsonify({'success': False, 'error': '沒有檔案'}), 400
+        folder_id = request.form.get('folder_id')
+        folder_link = None
+
+        config, _ = sheets_handler.get_system_settings()
+        root_id = config.get('ROOT_FOLDER_ID')
+        gas_url = config.get('WEB_APP_URL')
+        gas_api_key = config.get('API_KEY')
+        if not root_id:
+            return jsonify({'success': False, 'error': '未設定 Root Folder ID'}), 500
+
+        try:
+            if not folder_id:
+                folder_name = report_folder_name(request.form.get('item_name') or '未命名設備')
+                folder_id, folder_link = drive_handler.create_subfolder(folder_name, root_id, gas_url, gas_api_key)
+            uploads = [(f.stream, make_unique_filename(f.filename), f.mimetype) for f in files]
+            results = drive_handler.upload_files_to_drive(uploads, folder_id, gas_url, gas_api_key)
+        except Exception as e:
+            print(f"批次上傳失敗: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+        urls = [url for url, _ in results if url]
+        errors = [str(err) for _, err in results if err]
+        return jsonify({
+            'success': bool(urls),
+            'folder_id': folder_id,
+            'folder_link': folder_link,
+            'urls': urls,
+            'failed': len(errors),
+            'errors': errors
+        }), (200 if urls else 500)
+
+    # --- 管理 ---
+    @app.route("/api/admin/refresh_cache", methods=['POST'])
+    def api_admin_refresh_cache():
+        # 以「系統參數設定」的 API_KEY 驗證 (可由 GAS onEdit 觸發器呼叫)
+        d = request.get_json(silent=True) or {}
+        if not is_admin_request(d):
+            return jsonify({'success': False, 'error': '權限不足'}), 403
+        refreshed = ttl_cache.refresh(d.get('name'))
+        _page_cache.clear()
+        return jsonify({'success': True, 'refreshed': refreshed})
+
+    @app.route("/api/admin/stats")
+    def api_admin_stats():
+        if not is_admin_request():
+            return jsonify({'success': False, 'error': '權限不足'}), 403
+        stats = {'webhook': webhook_queue.stats(), 'image_compression': drive_handler.compression_stats(), 'page_cache': len(_page_cache)}
+        try:
+            stats['journal_pending'] = write_journal.pending_count()
+        except Exception as e:
+            stats['journal_pending'] = None
+        return jsonify(stats)
+
     @app.route("/health")
     def health_check():
         return "OK", 200
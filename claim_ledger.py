@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+import time
+import write_journal
+
+# ==========================================
+#  臨時任務認領計數 (所有 worker 共用)
+#  與寫入日誌共用同一個 SQLite 檔，認領與寫回都在 BEGIN IMMEDIATE 交易中進行：
+#  每個 worker 看到的都是同一份「已認領、尚未寫回試算表」的人數，不會超額認領。
+# ==========================================
+
+# 寫回試算表期間會持有寫入鎖，認領最多等待的秒數
+BUSY_TIMEOUT = 30
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(write_journal.JOURNAL_PATH, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if not _initialized:
+        with _init_lock:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS task_claims (
+                    task_id TEXT PRIMARY KEY,
+                    pending INTEGER NOT NULL DEFAULT 0,
+                    synced INTEGER,
+                    synced_at REAL
+                )
+            """)
+            _initialized = True
+    return conn
+
+
+def _claimed(row, current, loaded_at):
+    # row: (pending, synced, synced_at)
+    # 最近一次寫回晚於帳本載入時，帳本中的人數可能是寫回前的舊值，改用寫回後的人數
+    if row is None: return current
+    pending, synced, synced_at = row
+    base = synced if synced is not None and synced_at >= loaded_at else current
+    return base + pending
+
+
+def claimed_counts(tasks, loaded_at):
+    """tasks: {task_id: {"current": 試算表人數, ...}}，回傳 {task_id: 含尚未寫回的認領人數}"""
+    conn = _connect()
+    try:
+        rows = {r[0]: r[1:] for r in conn.execute("SELECT task_id, pending, synced, synced_at FROM task_claims")}
+    finally:
+        conn.close()
+    return {tid: _claimed(rows.get(tid), t["current"], loaded_at) for tid, t in tasks.items()}
+
+
+def reserve(task_id, current, needed, loaded_at):
+    """認領一個名額；已滿則回傳 False"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT pending, synced, synced_at FROM task_claims WHERE task_id=?", (task_id,)).fetchone()
+            if _claimed(row, current, loaded_at) >= needed:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT INTO task_claims (task_id, pending) VALUES (?, 1) "
+                "ON CONFLICT(task_id) DO UPDATE SET pending = pending + 1",
+                (task_id,)
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def has_pending():
+    conn = _connect()
+    try:
+        return conn.execute("SELECT 1 FROM task_claims WHERE pending > 0 LIMIT 1").fetchone() is not None
+    finally:
+        conn.close()
+
+
+def reconcile(write):
+    """
+    把所有 worker 累積的認領數寫回試算表。
+    write(pending) 接收 {task_id: 待寫回人數}，回傳 (synced, dropped)：
+    synced 為 {task_id: 寫回後的試算表人數}，dropped 為已從表上移除的任務；
+    其餘任務 (例如列號變動) 保留待寫回數，下次再寫。
+    寫回期間持有寫入鎖，其他 worker 的認領會等到寫回完成。
+    """
+    if not has_pending(): return
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            pending = dict(conn.execute("SELECT task_id, pending FROM task_claims WHERE pending > 0").fetchall())
+            if pending:
+                synced, dropped = write(pending)
+                now = time.time()
+                conn.executemany(
+                    "UPDATE task_claims SET pending=0, synced=?, synced_at=? WHERE task_id=?",
+                    [(count, now, tid) for tid, count in synced.items()]
+                )
+                conn.executemany("DELETE FROM task_claims WHERE task_id=?", [(tid,) for tid in dropped])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
@@ -2,26 +2,149 @@ import os
 import json
 import requests
 import base64
-import io
-from PIL import Image  # 需要安裝 Pillow 套件 (pip install Pillow)
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from googleapiclient.errors import HttpError
-from oauth2client.service_account import ServiceAccountCredentials
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import sheets_handler
 
 # ==========================================
 #  【資安優化】
 #   GAS_API_KEY 已移除，改由函式參數動態傳入
 # ==========================================
 
-# 設定權限範圍
-SCOPES = ['https://www.googleapis.com/auth/drive']
+# Drive API 請求逾時 (秒)
+DRIVE_HTTP_TIMEOUT = int(os.getenv('DRIVE_HTTP_TIMEOUT', 120))
+_thread_local = threading.local()
+
+# 偵測到 Service Account 空間不足後，多久內直接改走 GAS (秒)
+DRIVE_QUOTA_COOLDOWN = int(os.getenv('DRIVE_QUOTA_COOLDOWN', 1800))
+_quota_exhausted_until = 0.0
+# GAS 是否支援二進位上傳 (None = 尚未確認)
+_gas_binary_supported = None
+# 尚未確認時 GAS 拒絕二進位上傳後，多久內改用 JSON 格式 (秒)；之後再試一次二進位。
+# 拒絕也可能是暫時性錯誤 (配額、呼叫過於頻繁時 GAS 回傳 HTML)，不能永久降級
+GAS_BINARY_RETRY = int(os.getenv('GAS_BINARY_RETRY', 600))
+_gas_binary_retry_at = 0.0
+
+PUBLIC_PERMISSION = {'type': 'anyone', 'role': 'reader'}
+# 資料夾 id -> 是否已公開 (自己建立並設為公開的資料夾，或查詢過權限的上層資料夾)
+_public_folders = {}
+
+# Drive resumable 上傳每塊大小 (需為 256KB 的倍數)，單次上傳的記憶體用量以此為上限
+UPLOAD_CHUNK_SIZE = max(1, int(os.getenv('DRIVE_UPLOAD_CHUNK_SIZE', 1024 * 1024)) // (256 * 1024)) * 256 * 1024
+
+# 圖片壓縮 process pool
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_TIMEOUT = 60
+_image_pool = None
+_image_pool_pid = None
+_image_pool_lock = threading.Lock()
+# 批次上傳時同時進行的檔案數
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+_upload_pool = None
+_compress_stats = {"count": 0, "failed": 0, "wait_total": 0.0, "wait_max": 0.0, "encode_total": 0.0, "encode_max": 0.0}
 
 
 def get_drive_service():
-    """建立 Google Drive 服務連線 (使用 Service Account)"""
-    creds = ServiceAccountCredentials.from_json_keyfile_name('service_account.json', SCOPES)
-    return build('drive', 'v3', credentials=creds)
+    """
+    取得 Google Drive 服務連線 (使用 Service Account)
+    - 每個執行緒快取一個 service (httplib2 非 thread-safe)，連線保持 keep-alive
+    - 使用套件內建的靜態 discovery 文件，不必每次下載、解析
+    - 憑證與 sheets_handler 共用，Token 快到期時統一更新
+    """
+    creds = sheets_handler.get_credentials()
+    service = getattr(_thread_local, 'drive_service', None)
+    if service is None:
+        # googleapiclient 載入較慢，等到第一次用到 Drive 才匯入，縮短啟動時間
+        from googleapiclient.discovery import build
+        from google_auth_httplib2 import AuthorizedHttp
+        import httplib2
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+        service = build('drive', 'v3', http=http, static_discovery=True, cache_discovery=False)
+        _thread_local.drive_service = service
+    return service
+
+
+def _compress_file(src_path, dst_path, max_size, quality, submitted_at):
+    """
+    在子行程中執行的壓縮工作 (需為模組層級函式才能傳給 ProcessPool)：
+    - JPEG 以 draft 模式在解碼時就縮小 (1/2、1/4、1/8)，不必解出整張原圖
+    - 依 EXIF 方向轉正，避免手機直拍的照片上傳後變橫的
+    回傳 (原始格式, 排隊等待秒數, 壓縮秒數)
+    """
+    from PIL import Image, ImageOps  # 需要安裝 Pillow 套件 (pip install Pillow)
+    started = time.time()
+    with Image.open(src_path) as image:
+        src_format = image.format
+        if src_format == 'JPEG':
+            image.draft('RGB', max_size)
+        image = ImageOps.exif_transpose(image)
+
+        # 如果不是 RGB (例如 PNG 透明圖)，轉為 RGB 以存為 JPEG
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        # 計算縮放比例 (保持長寬比)
+        image.thumbnail(max_size, Image.LANCZOS)
+        image.save(dst_path, format='JPEG', quality=quality)
+    return src_format, started - submitted_at, time.time() - started
+
+
+def _image_pool_context():
+    # 不用 fork：此時行程內已有 webhook、日誌同步等背景執行緒，fork 出的子行程可能卡在複製來的鎖上
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        # 只預先載入本模組，不在 forkserver 中重新執行 main.py 的初始化
+        ctx.set_forkserver_preload(['drive_handler'])
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+def _get_image_pool():
+    global _image_pool, _image_pool_pid
+    if _image_pool is None or _image_pool_pid != os.getpid():
+        with _image_pool_lock:
+            if _image_pool is None or _image_pool_pid != os.getpid():
+                _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=_image_pool_context())
+                _image_pool_pid = os.getpid()
+    return _image_pool
+
+
+def _record_compression(wait, encode, failed=False):
+    with _image_pool_lock:
+        if failed:
+            _compress_stats["failed"] += 1
+            return
+        _compress_stats["count"] += 1
+        _compress_stats["wait_total"] += wait
+        _compress_stats["wait_max"] = max(_compress_stats["wait_max"], wait)
+        _compress_stats["encode_total"] += encode
+        _compress_stats["encode_max"] = max(_compress_stats["encode_max"], encode)
+
+
+def compression_stats():
+    with _image_pool_lock:
+        data = dict(_compress_stats)
+    n = data["count"] or 1
+    data["wait_avg"] = data["wait_total"] / n
+    data["encode_avg"] = data["encode_total"] / n
+    return data
+
+
+def _local_path(file_stream):
+    """取得上傳串流在磁碟上的路徑；沒有的話 (BytesIO / 匿名暫存檔) 先分塊複製成暫存檔"""
+    name = getattr(file_stream, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name, None
+    file_stream.seek(0)
+    src = tempfile.NamedTemporaryFile(suffix='.upload')
+    shutil.copyfileobj(file_stream, src, UPLOAD_CHUNK_SIZE)
+    src.flush()
+    return src.name, src
 
 
 def compress_image(file_stream, max_size=(1024, 1024), quality=80):
@@ -29,29 +152,34 @@ def compress_image(file_stream, max_size=(1024, 1024), quality=80):
     圖片壓縮功能：
     將手機拍攝的大尺寸照片縮小至 1024px 寬度，並將品質降至 80%。
     這能顯著提高 GAS 轉傳的成功率。
+    壓縮在獨立的 process pool 中執行，不佔用請求執行緒的 CPU。
     """
+    global _image_pool
+    src_tmp = None
+    output_stream = tempfile.NamedTemporaryFile(suffix='.jpg')
     try:
-        # 讀取圖片
-        image = Image.open(file_stream)
-
-        # 如果不是 RGB (例如 PNG 透明圖)，轉為 RGB 以存為 JPEG
-        if image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
-
-        # 計算縮放比例 (保持長寬比)
-        image.thumbnail(max_size, Image.LANCZOS)
+        src_path, src_tmp = _local_path(file_stream)
+        args = (src_path, output_stream.name, max_size, quality, time.time())
+        try:
+            src_format, wait, encode = _get_image_pool().submit(_compress_file, *args).result(timeout=IMAGE_TIMEOUT)
+        except BrokenProcessPool:
+            # 子行程異常結束 (例如記憶體不足)：關閉壞掉的 pool 並重建，這次在本行程壓縮
+            broken, _image_pool = _image_pool, None
+            if broken is not None: broken.shutdown(wait=False)
+            src_format, wait, encode = _compress_file(*args)
+        _record_compression(wait, encode)
 
-        # 存入記憶體
-        output_stream = io.BytesIO()
-        image.save(output_stream, format='JPEG', quality=quality)
         output_stream.seek(0)
-
-        print(f"📉 圖片壓縮完成 (原始格式: {image.format})")
+        print(f"📉 圖片壓縮完成 (原始格式: {src_format}，排隊 {wait:.2f}s，壓縮 {encode:.2f}s)")
         return output_stream, 'image/jpeg'
     except Exception as e:
+        _record_compression(0, 0, failed=True)
+        output_stream.close()
         print(f"⚠️ 圖片壓縮失敗 (可能是非圖片檔)，將使用原檔上傳: {e}")
         file_stream.seek(0)
         return file_stream, None
+    finally:
+        if src_tmp is not None: src_tmp.close()
 
 
 def create_subfolder(folder_name, parent_id, gas_url=None, api_key=None):
@@ -81,16 +209,19 @@ def create_subfolder(folder_name, parent_id, gas_url=None, api_key=None):
         folder_id = file.get('id')
         print(f"✅ 已建立子資料夾: {folder_name}, ID: {folder_id}")
 
-        # 2. 嘗試設定權限 (失敗不中斷)
-        try:
-            permission = {'type': 'anyone', 'role': 'reader'}
-            service.permissions().create(
-                fileId=folder_id,
-                body=permission,
-                supportsAllDrives=True
-            ).execute()
-        except Exception as perm_err:
-            print(f"⚠️ 無法設定資料夾公開權限 (可能權限不足，但不影響建立): {perm_err}")
+        # 2. 嘗試設定權限 (上層已公開則直接繼承；失敗不中斷)
+        if _is_public_folder(service, parent_id):
+            _public_folders[folder_id] = True
+        else:
+            try:
+                service.permissions().create(
+                    fileId=folder_id,
+                    body=PUBLIC_PERMISSION,
+                    supportsAllDrives=True
+                ).execute()
+                _public_folders[folder_id] = True
+            except Exception as perm_err:
+                print(f"⚠️ 無法設定資料夾公開權限 (可能權限不足，但不影響建立): {perm_err}")
 
         return folder_id, file.get('webViewLink')
 
@@ -99,23 +230,113 @@ def create_subfolder(folder_name, parent_id, gas_url=None, api_key=None):
         raise e
 
 
-def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=None, api_key=None):
+def _is_public_folder(service, folder_id):
+    """資料夾是否已開放「知道連結的人皆可檢視」；結果快取，每個資料夾只查一次"""
+    public = _public_folders.get(folder_id)
+    if public is not None: return public
+    try:
+        res = service.permissions().list(
+            fileId=folder_id,
+            fields='permissions(type,role)',
+            supportsAllDrives=True
+        ).execute()
+        public = any(p.get('type') == 'anyone' for p in res.get('permissions', []))
+    except Exception as e:
+        print(f"⚠️ 無法查詢資料夾權限，將逐檔設定公開: {e}")
+        public = False
+    _public_folders[folder_id] = public
+    return public
+
+
+def grant_public_access(service, file_ids):
+    """將檔案設為公開；多個檔案時以一次 batch request 送出"""
+    def _on_result(request_id, response, exception):
+        if exception is not None:
+            print(f"⚠️ 無法設定檔案公開權限 (可忽略): {exception}")
+
+    if len(file_ids) == 1:
+        try:
+            service.permissions().create(fileId=file_ids[0], body=PUBLIC_PERMISSION, supportsAllDrives=True).execute()
+        except Exception as perm_e:
+            _on_result(None, None, perm_e)
+        return
+
+    # Drive batch 一次最多 100 筆
+    for i in range(0, len(file_ids), 100):
+        batch = service.new_batch_http_request(callback=_on_result)
+        for file_id in file_ids[i:i + 100]:
+            batch.add(service.permissions().create(fileId=file_id, body=PUBLIC_PERMISSION, supportsAllDrives=True))
+        try:
+            batch.execute()
+        except Exception as perm_e:
+            _on_result(None, None, perm_e)
+
+
+def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=None, api_key=None, pending_grants=None):
     """
     上傳檔案到 Google Drive (智慧切換模式)
     新增參數: api_key (從 Sheets 讀取的金鑰)
+    pending_grants: 傳入 list 時不逐檔設定權限，改把 file id 收集起來由呼叫端批次設定
     """
     if not parent_id:
         raise ValueError("未指定上傳目標資料夾 ID")
 
     # [步驟 1] 自動壓縮圖片
+    upload_stream = file_stream
     if mime_type.startswith('image/'):
         print(f"🔄 正在優化圖片大小: {filename}...")
-        file_stream, new_mime = compress_image(file_stream)
+        upload_stream, new_mime = compress_image(file_stream)
         if new_mime:
             mime_type = new_mime
             if not filename.lower().endswith('.jpg'):
                 filename = filename.rsplit('.', 1)[0] + '.jpg'
 
+    try:
+        return _upload_stream(upload_stream, filename, mime_type, parent_id, gas_url, api_key, pending_grants)
+    finally:
+        # 壓縮產生的暫存檔用完即刪除 (原始上傳串流由 Werkzeug 負責)
+        if upload_stream is not file_stream:
+            upload_stream.close()
+
+
+def upload_files_to_drive(uploads, parent_id, gas_url=None, api_key=None):
+    """
+    平行上傳多個檔案 (每個執行緒各自的 Drive 連線)
+    uploads: [(file_stream, filename, mime_type), ...]
+    回傳與輸入同順序的 [(url, error), ...]
+    """
+    pending_grants = []
+
+    def _one(item):
+        file_stream, filename, mime_type = item
+        try:
+            return upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url, api_key, pending_grants), None
+        except Exception as e:
+            return None, e
+
+    results = list(_get_upload_pool().map(_one, uploads))
+    # 資料夾未公開時，所有檔案的權限一次批次設定
+    if pending_grants:
+        grant_public_access(get_drive_service(), pending_grants)
+    return results
+
+
+def _get_upload_pool():
+    global _upload_pool
+    if _upload_pool is None:
+        with _image_pool_lock:
+            if _upload_pool is None:
+                _upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="drive-upload")
+    return _upload_pool
+
+
+def _upload_stream(file_stream, filename, mime_type, parent_id, gas_url, api_key, pending_grants=None):
+    from googleapiclient.http import MediaIoBaseUpload
+    from googleapiclient.errors import HttpError
+    # 近期已確認空間不足：不再白傳一次給 Service Account，直接走 GAS
+    if _quota_circuit_open() and gas_url and api_key:
+        return _upload_via_gas(file_stream, filename, mime_type, parent_id, gas_url, api_key)
+
     service = get_drive_service()
 
     file_metadata = {
@@ -123,12 +344,8 @@ def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=No
         'parents': [parent_id]
     }
 
-    # 讀取內容至記憶體
-    file_content = file_stream.read()
-
-    from io import BytesIO
-    media_stream = BytesIO(file_content)
-    media = MediaIoBaseUpload(media_stream, mimetype=mime_type, resumable=True)
+    # 直接以串流分塊上傳，不把整個檔案讀進記憶體
+    media = MediaIoBaseUpload(file_stream, mimetype=mime_type, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
 
     try:
         print(f"🚀 嘗試使用 Service Account 上傳: {filename}")
@@ -144,15 +361,12 @@ def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=No
         file_id = file.get('id')
         print(f"✅ Service Account 上傳成功 (Parent: {parent_id}), ID: {file_id}")
 
-        try:
-            permission = {'type': 'anyone', 'role': 'reader'}
-            service.permissions().create(
-                fileId=file_id,
-                body=permission,
-                supportsAllDrives=True
-            ).execute()
-        except Exception as perm_e:
-            print(f"⚠️ 無法設定檔案公開權限 (可忽略): {perm_e}")
+        # 放在公開資料夾中的檔案會繼承權限，不必另外設定
+        if not _is_public_folder(service, parent_id):
+            if pending_grants is not None:
+                pending_grants.append(file_id)
+            else:
+                grant_public_access(service, [file_id])
 
         return f"https://drive.google.com/uc?export=view&id={file_id}"
 
@@ -167,6 +381,8 @@ def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=No
         print(f"⚠️ Service Account 上傳失敗 (Reason: {error_reason})")
 
         # [步驟 3] 判斷是否為配額問題 -> 切換 GAS
+        if error_reason == 'storageQuotaExceeded':
+            _trip_quota_circuit()
         if error_reason == 'storageQuotaExceeded' and gas_url:
             print("🔄 偵測到配額不足，正在切換至 GAS 代理上傳...")
 
@@ -175,7 +391,7 @@ def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=No
                 print("❌ 切換失敗：未設定 GAS_API_KEY (請檢查 Google Sheets 系統參數)")
                 raise e
 
-            return _upload_via_gas(file_content, filename, mime_type, parent_id, gas_url, api_key)
+            return _upload_via_gas(file_stream, filename, mime_type, parent_id, gas_url, api_key)
         else:
             print(f"❌ 上傳發生無法處理的錯誤: {e}")
             raise e
@@ -185,15 +401,70 @@ def upload_file_to_drive(file_stream, filename, mime_type, parent_id, gas_url=No
         raise e
 
 
-def _upload_via_gas(file_content_bytes, filename, mime_type, parent_id, gas_url, api_key):
+class GasRejected(Exception):
+    """GAS 有回應但明確拒絕這次請求 (回傳錯誤訊息或非 JSON)，與連線失敗、逾時區分"""
+
+
+def _quota_circuit_open():
+    return time.time() < _quota_exhausted_until
+
+
+def _trip_quota_circuit():
+    global _quota_exhausted_until
+    _quota_exhausted_until = time.time() + DRIVE_QUOTA_COOLDOWN
+    print(f"⚡ Service Account 空間已滿，接下來 {DRIVE_QUOTA_COOLDOWN} 秒直接改走 GAS 上傳")
+
+
+def _upload_via_gas(file_stream, filename, mime_type, parent_id, gas_url, api_key):
     """
     內部函式：透過 GAS 上傳
     包含 API_KEY 安全驗證機制 (動態傳入)
+    優先以二進位串流送出 (不做 base64)，GAS 端不支援時才退回舊的 JSON 格式
     """
+    global _gas_binary_supported, _gas_binary_retry_at
     if not gas_url:
         raise ValueError("切換失敗：未設定 GAS URL (WEB_APP_URL)")
 
-    file_b64 = base64.b64encode(file_content_bytes).decode('utf-8')
+    if _gas_binary_supported or time.time() >= _gas_binary_retry_at:
+        try:
+            url = _upload_via_gas_binary(file_stream, filename, mime_type, parent_id, gas_url, api_key)
+            _gas_binary_supported = True
+            return url
+        except GasRejected as e:
+            if _gas_binary_supported:
+                raise
+            # 尚未確認支援時 GAS 拒絕：可能是舊版 GAS，也可能是暫時性錯誤，
+            # 這次改用 JSON，冷卻時間過後再試二進位。
+            # 逾時 / 連線錯誤不在此列 —— GAS 可能已存下檔案，重送會產生重複檔案
+            print(f"⚠️ GAS 拒絕二進位上傳，{GAS_BINARY_RETRY} 秒內改用 JSON 格式: {e}")
+            _gas_binary_retry_at = time.time() + GAS_BINARY_RETRY
+
+    file_stream.seek(0)
+    return _upload_via_gas_json(file_stream, filename, mime_type, parent_id, gas_url, api_key)
+
+
+def _upload_via_gas_binary(file_stream, filename, mime_type, parent_id, gas_url, api_key):
+    # 檔案以原始位元組為 body 串流送出，其餘參數放在 query string (GAS 以 e.parameter 讀取)
+    params = {
+        "action": "upload_file_raw",
+        "folder_id": parent_id,
+        "filename": filename,
+        "mimetype": mime_type,
+        "api_key": api_key
+    }
+    file_stream.seek(0)
+    print(f"📡 呼叫 GAS 代理上傳 (binary): {gas_url}")
+    try:
+        response = requests.post(gas_url, params=params, data=file_stream, headers={"Content-Type": mime_type},
+                                 allow_redirects=True, timeout=45)
+    except requests.RequestException as e:
+        # 例外訊息含完整網址 (包括 query string 中的 api_key)，不可原樣外傳或寫進 log
+        raise Exception(f"GAS 連線失敗 ({type(e).__name__})") from None
+    return _parse_gas_response(response, filename)
+
+
+def _upload_via_gas_json(file_stream, filename, mime_type, parent_id, gas_url, api_key):
+    file_b64 = base64.b64encode(file_stream.read()).decode('utf-8')
 
     payload = {
         "action": "upload_file",
@@ -208,42 +479,44 @@ def _upload_via_gas(file_content_bytes, filename, mime_type, parent_id, gas_url,
         print(f"📡 呼叫 GAS 代理上傳: {gas_url}")
         # 設定 timeout，避免 GAS 冷啟動過久卡住
         response = requests.post(gas_url, json=payload, allow_redirects=True, timeout=45)
+        return _parse_gas_response(response, filename)
+    except Exception as e:
+        print(f"❌ GAS 上傳失敗: {e}")
+        raise e
 
-        # 錯誤診斷
-        if response.status_code != 200:
-            print(f"GAS HTTP Error: {response.status_code}")
-            print(f"Response Text: {response.text[:200]}")
-            if "google.com" in response.text:
-                raise Exception(f"GAS 部署權限錯誤 (HTTP {response.status_code})：請確認部署為「所有人 (Anyone)」")
-            raise Exception(f"GAS 伺服器錯誤 (HTTP {response.status_code})")
 
-        try:
-            resp_data = response.json()
-        except ValueError:
-            print(f"❌ GAS 回傳內容非 JSON: {response.text}")
-            raise Exception(f"GAS 回應解析失敗，非 JSON 格式。")
-
-        # 寬鬆判斷成功狀態
-        is_success = (
-                resp_data.get("status") == "success" or
-                resp_data.get("success") is True or
-                resp_data.get("file_url") is not None
-        )
-
-        if is_success:
-            print(f"✅ GAS 上傳檔案成功: {filename}")
-            # 優先回傳 file_url (直連)，若無則回傳 file_id 組裝
-            url = resp_data.get("file_url") or resp_data.get("url")
-            if url:
-                return url
-            elif resp_data.get("file_id"):
-                return f"https://drive.google.com/uc?export=view&id={resp_data.get('file_id')}"
-            else:
-                raise Exception("GAS 上傳成功但未回傳連結 (No file_url)")
-        else:
-            msg = resp_data.get('message') or resp_data.get('error') or '未知錯誤'
-            raise Exception(f"GAS 回傳錯誤: {msg}")
+def _parse_gas_response(response, filename):
+    # 錯誤診斷
+    if response.status_code != 200:
+        print(f"GAS HTTP Error: {response.status_code}")
+        print(f"Response Text: {response.text[:200]}")
+        if "google.com" in response.text:
+            raise Exception(f"GAS 部署權限錯誤 (HTTP {response.status_code})：請確認部署為「所有人 (Anyone)」")
+        raise Exception(f"GAS 伺服器錯誤 (HTTP {response.status_code})")
 
-    except Exception as e:
-        print(f"❌ GAS 上傳失敗: {e}")
-        raise e
\ No newline at end of file
+    try:
+        resp_data = response.json()
+    except ValueError:
+        print(f"❌ GAS 回傳內容非 JSON: {response.text}")
+        raise GasRejected(f"GAS 回應解析失敗，非 JSON 格式。")
+
+    # 寬鬆判斷成功狀態
+    is_success = (
+            resp_data.get("status") == "success" or
+            resp_data.get("success") is True or
+            resp_data.get("file_url") is not None
+    )
+
+    if is_success:
+        print(f"✅ GAS 上傳檔案成功: {filename}")
+        # 優先回傳 file_url (直連)，若無則回傳 file_id 組裝
+        url = resp_data.get("file_url") or resp_data.get("url")
+        if url:
+            return url
+        elif resp_data.get("file_id"):
+            return f"https://drive.google.com/uc?export=view&id={resp_data.get('file_id')}"
+        else:
+            raise Exception("GAS 上傳成功但未回傳連結 (No file_url)")
+    else:
+        msg = resp_data.get('message') or resp_data.get('error') or '未知錯誤'
+        raise GasRejected(f"GAS 回傳錯誤: {msg}")
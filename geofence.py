@@ -0,0 +1,59 @@
+import math
+
+EARTH_RADIUS = 6371000
+# 緯度 1 度約 111.32 公里
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """兩點間的球面距離 (公尺)"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS * c
+
+
+class GeofenceIndex:
+    """
+    打卡地點的網格索引：
+    每個地點依其半徑的外接矩形放進所有重疊的網格，
+    查詢時只需取出座標所在的那一格，先用矩形粗篩，再算球面距離找最近的地點。
+    """
+
+    def __init__(self, locations):
+        self.fences = []
+        for loc in locations:
+            lat, lng, radius = loc['lat'], loc['lng'], loc['radius']
+            dlat = radius / METERS_PER_DEGREE
+            dlng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+            self.fences.append((loc, lat - dlat, lat + dlat, lng - dlng, lng + dlng))
+
+        # 網格大小取最大半徑，每個地點最多落在少數幾格
+        max_radius = max((loc['radius'] for loc in locations), default=500)
+        self.cell = max(max_radius / METERS_PER_DEGREE, 0.001)
+        self.buckets = {}
+        for fence in self.fences:
+            _, min_lat, max_lat, min_lng, max_lng = fence
+            for i in range(self._cell_index(min_lat), self._cell_index(max_lat) + 1):
+                for j in range(self._cell_index(min_lng), self._cell_index(max_lng) + 1):
+                    self.buckets.setdefault((i, j), []).append(fence)
+
+    def _cell_index(self, value):
+        return int(math.floor(value / self.cell))
+
+    def nearest(self, lat, lng):
+        """回傳 (地點, 距離公尺)；不在任何地點範圍內則回傳 (None, None)"""
+        best, best_dist = None, None
+        for loc, min_lat, max_lat, min_lng, max_lng in self.buckets.get((self._cell_index(lat), self._cell_index(lng)), ()):
+            if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng): continue
+            dist = haversine(lat, lng, loc['lat'], loc['lng'])
+            if dist <= loc['radius'] and (best_dist is None or dist < best_dist):
+                best, best_dist = loc, dist
+        return best, best_dist
+
+    def nearest_many(self, points):
+        """批次查詢 (例如補登的打卡紀錄)：points 為 [(lat, lng), ...]"""
+        return [self.nearest(lat, lng) for lat, lng in points]
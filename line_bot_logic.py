@@ -1,13 +1,20 @@
 from linebot import LineBotApi, WebhookParser
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, FlexSendMessage
 import sheets_handler
-import math
+import geofence
+import ttl_cache
+import os
 import time
 
 line_bot_api = None
 parser = None
 settings = None
 
+# LINE 顯示名稱快取 (常客每週打卡多次，不必每次都查 profile)
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 2000))
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 86400))
+_display_names = ttl_cache.LRUCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
 def init_bot(app_settings):
     global line_bot_api, parser, settings
     settings = app_settings
@@ -16,14 +23,20 @@ def init_bot(app_settings):
     print("✅ LINE Bot 初始化完成")
 
 def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371000
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+    return geofence.haversine(lat1, lon1, lat2, lon2)
+
+def get_display_name(user_id):
+    """LINE 顯示名稱：先查快取，沒有才呼叫 get_profile，失敗時改用道親資料的姓名"""
+    name = _display_names.get(user_id)
+    if name: return name
+    try:
+        name = line_bot_api.get_profile(user_id).display_name
+    except:
+        profile = sheets_handler.get_user_full_profile(user_id)
+        name = profile.get("name") if "error" not in profile else None
+    if not name: return "前賢"
+    _display_names.set(user_id, name)
+    return name
 
 def handle_event(event):
     if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
@@ -56,13 +69,11 @@ def handle_text_message(reply_token, user_id, received_text):
 
             # [修改] 2. 距離檢查 (補單則跳過)
             if user_lat and user_lng:
-                config, locations = sheets_handler.get_system_settings()
-                for loc in locations:
-                    dist = calculate_distance(user_lat, user_lng, loc['lat'], loc['lng'])
-                    if dist <= loc['radius']:
-                        matched_location_name = loc['name']
-                        note = f"位置確認：{loc['name']} (距離{int(dist)}m)"
-                        break
+                # 以網格索引找出範圍內最近的地點
+                loc, dist = sheets_handler.get_geofence_index().nearest(user_lat, user_lng)
+                if loc:
+                    matched_location_name = loc['name']
+                    note = f"位置確認：{loc['name']} (距離{int(dist)}m)"
                 
                 if not matched_location_name and not is_missed:
                     reply_text = "⚠️ 打卡失敗！\n距離太遠，若為事後補登，請勾選「補打卡」。"
@@ -81,11 +92,7 @@ def handle_text_message(reply_token, user_id, received_text):
 
             if is_missed: note += " (補單)"
 
-            user_name = "前賢"
-            try:
-                profile = line_bot_api.get_profile(user_id)
-                user_name = profile.display_name
-            except: pass
+            user_name = get_display_name(user_id)
 
             success, msg = sheets_handler.append_checkin_data(user_id, user_name, category, note)
             
@@ -1,23 +1,52 @@
 import os
-import atexit
+import time
+import tempfile
+import threading
+
+_started = time.perf_counter()
+
 from config import Settings
 from app import create_app
 import line_bot_logic
 import rich_menu_handler
-from rich.console import Console
 
-console = Console()
+_imported = time.perf_counter()
 
-def init_full_application():
-    settings = Settings()
-    line_bot_logic.init_bot(settings)
-    
+# 啟動一次性工作的檔案鎖：gunicorn 多個 worker 中只有搶到鎖的那一個會執行
+STARTUP_LOCK_FILE = os.getenv('STARTUP_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'huilingong_startup.lock'))
+_leader_lock = None
+
+def acquire_startup_leader():
+    """
+    嘗試成為負責啟動工作的 process。
+    鎖會一直持有到 process 結束，其他 worker 不會重複執行；
+    若負責的 worker 重啟，新的 worker 會再搶到鎖 (選單內容未變時只會比對雜湊)。
+    """
+    global _leader_lock
+    if _leader_lock is not None: return True
+    try:
+        import fcntl
+    except ImportError:
+        # Windows 本機開發只有單一 process
+        return True
+    f = open(STARTUP_LOCK_FILE, 'w')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    f.write(str(os.getpid()))
+    f.flush()
+    _leader_lock = f
+    return True
+
+def build_menu_config(settings):
     # 選單設定
     menu_name = "HuiLinGong_Menu_Final"
     liff_base = f"https://liff.line.me/{settings.LIFF_ID}"
-    
+
     # 定義按鈕與連結
-    menu_config = {
+    return {
         "name": menu_name,
         "chatBarText": "開啟慧霖宮小幫手",
         "buttons": [
@@ -32,18 +61,39 @@ def init_full_application():
             {"label": "個人設定", "action": {"type": "uri", "uri": f"{liff_base}?page=settings"}}
         ]
     }
-    
+
+def update_rich_menu(settings):
     # 自動更新選單
+    started = time.perf_counter()
     try:
         print("🎨 更新選單中...")
         rich_menu_handler.create_and_set_rich_menu(
             settings.LINE_CHANNEL_ACCESS_TOKEN,
-            menu_config
+            build_menu_config(settings)
         )
     except Exception as e:
         print(f"⚠️ 選單更新警告: {e}")
-    
+    print(f"⏱️ 選單更新耗時 {time.perf_counter() - started:.2f}s")
+
+def init_full_application():
+    started = time.perf_counter()
+    settings = Settings()
+    line_bot_logic.init_bot(settings)
+    bot_ready = time.perf_counter()
+
+    # 選單更新只需一個 process 執行，並放到背景，不耽誤開始接受請求
+    leader = acquire_startup_leader()
+    if leader:
+        threading.Thread(target=update_rich_menu, args=(settings,), name="startup-rich-menu", daemon=True).start()
+
     app = create_app()
+    ready = time.perf_counter()
+
+    print(f"⏱️ 啟動耗時 (pid {os.getpid()}): 匯入模組 {_imported - _started:.2f}s"
+          f" / LINE Bot {bot_ready - started:.2f}s"
+          f" / 建立 App {ready - bot_ready:.2f}s"
+          f" / 合計 {ready - _started:.2f}s"
+          f"{' (負責選單更新)' if leader else ''}")
     return app, settings
 
 app, settings = init_full_application()
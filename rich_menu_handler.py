@@ -1,7 +1,7 @@
 import requests
 import json
 import os
-from PIL import Image, ImageDraw, ImageFont
+import hashlib
 
 # ================== 基本設定 ==================
 IMAGE_FILENAME = "rich_menu_generated.png"
@@ -33,30 +33,37 @@ ICON_MAPPING = {
 }
 
 def create_gradient_image(width, height, top_color, bottom_color):
+    from PIL import Image
     base = Image.new('RGB', (width, height), top_color)
     top = Image.new('RGB', (width, height), top_color)
     bottom = Image.new('RGB', (width, height), bottom_color)
-    mask = Image.new('L', (width, height))
-    mask_data = []
-    for y in range(height):
-        mask_data.extend([int(255 * (y / height))] * width)
-    mask.putdata(mask_data)
+    # 只產生一欄 (height 個像素) 的漸層值，再整塊橫向拉伸成 width 寬
+    column = bytes(int(255 * (y / height)) for y in range(height))
+    mask = Image.frombytes('L', (1, height), column).resize((width, height), Image.NEAREST)
     base.paste(bottom, (0, 0), mask)
     return base
 
-def draw_icon(draw, x, y, icon_char):
+def find_icon_font():
     # 嘗試多種路徑找字型
     font_paths = [
         "static/fonts/fa-solid-900.ttf",
         "static/fa-solid-900.ttf", 
         "static/fonts/Font Awesome 6 Free-Solid-900.otf"
     ]
-    font_path = None
     for p in font_paths:
         if os.path.exists(p):
-            font_path = p
-            break
-            
+            return p
+    return None
+
+def find_label_font():
+    # 找中文字型
+    font_path = "static/fonts/NotoSansTC-Bold.otf"
+    if not os.path.exists(font_path): font_path = "static/fonts/msjhbd.ttc" # Windows 備用
+    return font_path
+
+def draw_icon(draw, x, y, icon_char):
+    from PIL import ImageFont
+    font_path = find_icon_font()
     if not font_path:
         print("⚠️ 找不到 Icon 字型檔，將略過繪製圖示")
         return
@@ -68,6 +75,8 @@ def draw_icon(draw, x, y, icon_char):
         print(f"繪製圖示錯誤: {e}")
 
 def generate_rich_menu_image(menu_config):
+    # Pillow 只在選單需要重新產生時才載入
+    from PIL import ImageDraw, ImageFont
     img = create_gradient_image(IMAGE_WIDTH, IMAGE_HEIGHT, BG_GRADIENT_TOP, BG_GRADIENT_BOTTOM)
     draw = ImageDraw.Draw(img)
 
@@ -79,9 +88,7 @@ def generate_rich_menu_image(menu_config):
     draw.line([(0, IMAGE_HEIGHT/3), (IMAGE_WIDTH, IMAGE_HEIGHT/3)], fill=LINE_COLOR, width=5)
     draw.line([(0, IMAGE_HEIGHT*2/3), (IMAGE_WIDTH, IMAGE_HEIGHT*2/3)], fill=LINE_COLOR, width=5)
 
-    # 找中文字型
-    font_path = "static/fonts/NotoSansTC-Bold.otf"
-    if not os.path.exists(font_path): font_path = "static/fonts/msjhbd.ttc" # Windows 備用
+    font_path = find_label_font()
     
     try:
         font = ImageFont.truetype(font_path, FONT_SIZE)
@@ -109,8 +116,50 @@ def generate_rich_menu_image(menu_config):
     img.save(IMAGE_FILENAME)
     return IMAGE_FILENAME
 
+def menu_fingerprint(menu_config):
+    """選單設定 + 樣式常數 + 字型檔的雜湊；任何一項改變才需要重新產生選單"""
+    h = hashlib.sha256()
+    h.update(json.dumps(menu_config, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    h.update(repr((IMAGE_WIDTH, IMAGE_HEIGHT, ICON_SIZE, FONT_SIZE, BG_GRADIENT_TOP, BG_GRADIENT_BOTTOM,
+                   TEXT_COLOR, LINE_COLOR, ICON_COLOR, sorted(ICON_MAPPING.items()))).encode('utf-8'))
+    for path in (find_icon_font(), find_label_font()):
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+def _is_same_menu(name, base_name):
+    # 舊版選單名稱沒有雜湊後綴
+    return name == base_name or name.startswith(base_name + "#")
+
 def create_and_set_rich_menu(token, menu_config):
     try:
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        base_name = menu_config["name"]
+        # 把雜湊放在選單名稱中 (使用者看不到)，用來比對 LINE 上現有的選單
+        versioned_name = f"{base_name}#{menu_fingerprint(menu_config)}"
+
+        try:
+            old = requests.get("https://api.line.me/v2/bot/richmenu/list", headers=headers).json().get("richmenus", [])
+        except:
+            old = []
+        current = next((m for m in old if m["name"] == versioned_name), None)
+        if current:
+            try:
+                default_id = requests.get("https://api.line.me/v2/bot/user/all/richmenu", headers=headers).json().get("richMenuId")
+            except:
+                default_id = None
+            if default_id == current["richMenuId"]:
+                print("✅ 選單內容未變更，略過重新產生")
+                return
+            res = requests.post(f"https://api.line.me/v2/bot/user/all/richmenu/{current['richMenuId']}", headers=headers)
+            if res.status_code == 200:
+                print("✅ 選單內容未變更，已設為預設選單")
+                return
+            # 無法設為預設 (例如上次圖片沒有上傳成功)：刪掉這個選單，重新產生
+            print(f"⚠️ 既有選單無法設為預設 ({res.status_code})，重新產生")
+            requests.delete(f"https://api.line.me/v2/bot/richmenu/{current['richMenuId']}", headers=headers)
+
         generate_rich_menu_image(menu_config)
         
         w, h = IMAGE_WIDTH, IMAGE_HEIGHT
@@ -125,25 +174,27 @@ def create_and_set_rich_menu(token, menu_config):
             {"bounds": {"x": cw, "y": ch*2, "width": cw, "height": ch}, "action": menu_config["buttons"][5]["action"]},
         ]
 
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        
-        # 刪除舊選單
-        try:
-            old = requests.get("https://api.line.me/v2/bot/richmenu/list", headers=headers).json()
-            for m in old.get("richmenus", []):
-                if m["name"] == menu_config["name"]:
-                    requests.delete(f"https://api.line.me/v2/bot/richmenu/{m['richMenuId']}", headers=headers)
-        except: pass
-
-        body = {"size": {"width": w, "height": h}, "selected": True, "name": menu_config["name"], "chatBarText": menu_config["chatBarText"], "areas": areas}
+        body = {"size": {"width": w, "height": h}, "selected": True, "name": versioned_name, "chatBarText": menu_config["chatBarText"], "areas": areas}
         res = requests.post("https://api.line.me/v2/bot/richmenu", headers=headers, json=body)
         if res.status_code != 200: return
 
         rich_menu_id = res.json()["richMenuId"]
         with open(IMAGE_FILENAME, "rb") as f:
-            requests.post(f"https://api-data.line.me/v2/bot/richmenu/{rich_menu_id}/content", headers={"Authorization": f"Bearer {token}", "Content-Type": "image/png"}, data=f)
-        
-        requests.post(f"https://api.line.me/v2/bot/user/all/richmenu/{rich_menu_id}", headers=headers)
+            res = requests.post(f"https://api-data.line.me/v2/bot/richmenu/{rich_menu_id}/content", headers={"Authorization": f"Bearer {token}", "Content-Type": "image/png"}, data=f)
+        if res.status_code == 200:
+            res = requests.post(f"https://api.line.me/v2/bot/user/all/richmenu/{rich_menu_id}", headers=headers)
+        if res.status_code != 200:
+            # 圖片上傳或設為預設失敗：刪掉不完整的新選單，保留原本的選單，下次啟動再試
+            print(f"❌ 選單建立失敗 ({res.status_code}): {res.text[:200]}")
+            requests.delete(f"https://api.line.me/v2/bot/richmenu/{rich_menu_id}", headers=headers)
+            return
+
+        # 新選單生效後再刪除舊版本，避免中間沒有選單
+        try:
+            for m in old:
+                if _is_same_menu(m["name"], base_name) and m["richMenuId"] != rich_menu_id:
+                    requests.delete(f"https://api.line.me/v2/bot/richmenu/{m['richMenuId']}", headers=headers)
+        except: pass
         print("🎉 選單更新完成！")
 
     except Exception as e:
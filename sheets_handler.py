@@ -1,216 +1,637 @@
-import gspread
 import uuid
+import bisect
+import html
 import json
 import os
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta
 import telegram_handler # 確保檔案存在，否則會報錯
+import ttl_cache
+import geofence
+import write_journal
+import claim_ledger
 
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-def get_client():
+# --- 連線池設定 ---
+# Token 到期前多久主動更新 (秒)，避免請求途中才去換 Token
+TOKEN_REFRESH_MARGIN = int(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN', 300))
+# 共用 Session 的 keep-alive 連線數 (需 >= gunicorn threads)
+SHEETS_POOL_SIZE = int(os.getenv('SHEETS_POOL_SIZE', 10))
+
+_creds = None
+_client = None
+_client_lock = threading.Lock()
+
+def _load_credentials():
+    # gspread / google-auth 載入較慢，等到第一次存取試算表才匯入，縮短啟動時間
+    from google.oauth2.service_account import Credentials
     secret_path = '/etc/secrets/service_account.json'
     if os.path.exists(secret_path):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(secret_path, SCOPE)
-        return gspread.authorize(creds)
+        return Credentials.from_service_account_file(secret_path, scopes=SCOPE)
     
     json_key_env = os.getenv('GOOGLE_JSON_KEY')
     if json_key_env:
         try:
             creds_dict = json.loads(json_key_env)
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
-            return gspread.authorize(creds)
+            return Credentials.from_service_account_info(creds_dict, scopes=SCOPE)
         except: pass
     
     if os.path.exists('service_account.json'):
-        creds = ServiceAccountCredentials.from_json_keyfile_name('service_account.json', SCOPE)
-        return gspread.authorize(creds)
+        return Credentials.from_service_account_file('service_account.json', scopes=SCOPE)
     raise Exception("找不到 Google 憑證")
 
+def _token_expiring(creds):
+    if not creds.valid or not creds.expiry: return True
+    # google-auth 的 expiry 為 naive UTC
+    return creds.expiry - datetime.utcnow() < timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+def get_credentials():
+    """取得整個 process 共用的憑證 (只讀一次金鑰，快到期時由單一執行緒更新)"""
+    global _creds
+    with _client_lock:
+        if _creds is None:
+            _creds = _load_credentials()
+        if _token_expiring(_creds):
+            from google.auth.transport.requests import Request as AuthRequest
+            _creds.refresh(AuthRequest())
+        return _creds
+
+def get_client():
+    """取得共用的 gspread client (同一個 keep-alive Session 供所有執行緒使用)"""
+    global _client
+    creds = get_credentials()
+    if _client is not None: return _client
+    with _client_lock:
+        if _client is None:
+            import gspread
+            client = gspread.authorize(creds)
+            # gspread 6 將 Session 放在 http_client，5.x 則直接在 client 上
+            session = getattr(client, 'http_client', client).session
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SHEETS_POOL_SIZE)
+            session.mount("https://", adapter)
+            _client = client
+        return _client
+
+# --- 試算表 / 工作表 Handle 快取 ---
+SPREADSHEET_NAME = "公堂壇務運作管理系統"
+# 設定 GOOGLE_SHEET_ID 可直接以 key 開啟，省去一次 Drive 標題搜尋
+SPREADSHEET_KEY = os.getenv('GOOGLE_SHEET_ID')
+
+# 自動建立的工作表：(列數, 欄數, 標題列)
+WORKSHEET_DEFAULTS = {
+    "班程報名紀錄": (1000, 9, ["時間","日期","名稱","姓名","電話","午餐","晚餐","備註","ID"]),
+    "了愿打卡紀錄": (1000, 6, None),
+    "故障申報紀錄": (100, 8, None),
+}
+
+# 系統參數設定快取秒數 (過期後先回舊值，背景更新)
+SETTINGS_CACHE_TTL = int(os.getenv('SETTINGS_CACHE_TTL', 300))
+# 道親資料索引整表重讀的間隔 (新增的列會在查無資料時即時補讀)
+USER_DIRECTORY_TTL = int(os.getenv('USER_DIRECTORY_TTL', 600))
+# 班程報名索引整表重讀的間隔
+SIGNUP_INDEX_TTL = int(os.getenv('SIGNUP_INDEX_TTL', 300))
+# 班程資訊快取秒數 (表有異動時可由 /api/admin/refresh_cache 立即更新)
+CALENDAR_CACHE_TTL = int(os.getenv('CALENDAR_CACHE_TTL', 600))
+# 了愿項目快取秒數
+CATEGORIES_CACHE_TTL = int(os.getenv('CATEGORIES_CACHE_TTL', 600))
+# 了愿統計整表重建的間隔 (其間靠每次打卡累加)
+CHECKIN_STATS_TTL = int(os.getenv('CHECKIN_STATS_TTL', 3600))
+# 補讀其他 worker 新增資料列的最短間隔 (秒)，其間的查詢只讀記憶體
+TAIL_READ_INTERVAL = float(os.getenv('TAIL_READ_INTERVAL', 15))
+# 臨時任務快取秒數，以及認領人數寫回試算表的間隔
+TASKS_CACHE_TTL = int(os.getenv('TASKS_CACHE_TTL', 120))
+TASK_RECONCILE_INTERVAL = float(os.getenv('TASK_RECONCILE_INTERVAL', 5))
+
+_spreadsheet = None
+_worksheets = {}
+_registry_lock = threading.Lock()
+
+def get_spreadsheet():
+    global _spreadsheet, SPREADSHEET_KEY
+    if _spreadsheet is not None: return _spreadsheet
+    with _registry_lock:
+        if _spreadsheet is None:
+            client = get_client()
+            if SPREADSHEET_KEY:
+                _spreadsheet = client.open_by_key(SPREADSHEET_KEY)
+            else:
+                # 第一次以標題搜尋後記住 key，之後重新解析都走 open_by_key
+                _spreadsheet = client.open(SPREADSHEET_NAME)
+                SPREADSHEET_KEY = _spreadsheet.id
+        return _spreadsheet
+
+def get_worksheet(name):
+    import gspread
+    sheet = _worksheets.get(name)
+    if sheet is not None: return sheet
+    wb = get_spreadsheet()
+    with _registry_lock:
+        sheet = _worksheets.get(name)
+        if sheet is None:
+            try:
+                sheet = wb.worksheet(name)
+            except gspread.exceptions.WorksheetNotFound:
+                if name not in WORKSHEET_DEFAULTS: raise
+                rows, cols, header = WORKSHEET_DEFAULTS[name]
+                try:
+                    sheet = wb.add_worksheet(name, rows, cols)
+                    if header: sheet.append_row(header)
+                except gspread.exceptions.APIError:
+                    # 其他 worker 同時建立了同名工作表
+                    sheet = wb.worksheet(name)
+            _worksheets[name] = sheet
+        return sheet
+
+def invalidate_handles(name=None):
+    """清除快取的 handle，下次使用時重新解析"""
+    global _spreadsheet
+    with _registry_lock:
+        if name is None:
+            _spreadsheet = None
+            _worksheets.clear()
+        else:
+            _worksheets.pop(name, None)
+
+def _is_not_found(e):
+    response = getattr(e, 'response', None)
+    return getattr(response, 'status_code', None) == 404
+
+@contextmanager
+def open_worksheet(name):
+    """取得快取的工作表；若 API 回 404 (表被刪除或改名) 則清掉 handle 讓下次重新解析"""
+    import gspread
+    sheet = get_worksheet(name)
+    try:
+        yield sheet
+    except (gspread.exceptions.APIError, gspread.exceptions.WorksheetNotFound) as e:
+        if isinstance(e, gspread.exceptions.WorksheetNotFound):
+            invalidate_handles(name)
+        elif _is_not_found(e):
+            invalidate_handles()
+        raise
+
+# --- 批次寫入 ---
+class CellBatch:
+    """收集同一張工作表的儲存格修改，commit() 時以一次 batch_update 寫入"""
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.updates = {}
+
+    def set(self, row, col, value):
+        from gspread.utils import rowcol_to_a1
+        # 同一格重複設定時以最後一次為準
+        self.updates[rowcol_to_a1(row, col)] = value
+
+    def commit(self):
+        if not self.updates: return
+        data = [{'range': a1, 'values': [[v]]} for a1, v in self.updates.items()]
+        # 與 update_cell 相同，以 USER_ENTERED 寫入 (數字不會變成文字)
+        self.sheet.batch_update(data, value_input_option='USER_ENTERED')
+        self.updates = {}
+
+@contextmanager
+def batch_cells(name):
+    """with batch_cells("道親資料") as batch: batch.set(...) —— 離開區塊時一次寫入"""
+    with open_worksheet(name) as sheet:
+        batch = CellBatch(sheet)
+        yield batch
+        batch.commit()
+
 def clean_sheet_string(s):
     if not s: return ""
     return str(s).replace('\xa0', ' ').strip()
 
-def get_system_settings():
-    try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("系統參數設定")
+def _load_system_settings():
+    with open_worksheet("系統參數設定") as sheet:
         data = sheet.get_all_values()
-        config = {'ALLOWED_DISTANCE': 500}
-        for row in data[1:]:
-            if len(row) >= 2 and row[0]: config[row[0].strip()] = row[1].strip()
-        
-        locations = []
-        for row in data[1:]:
-            if len(row) >= 6 and row[3]:
-                try:
-                    locations.append({
-                        "name": row[3].strip(),
-                        "lat": float(row[4].strip()),
-                        "lng": float(row[5].strip()),
-                        "radius": int(row[6].strip()) if row[6].isdigit() else 500
-                    })
-                except: continue
-        return config, locations
+    config = {'ALLOWED_DISTANCE': 500}
+    for row in data[1:]:
+        if len(row) >= 2 and row[0]: config[row[0].strip()] = row[1].strip()
+    
+    locations = []
+    for row in data[1:]:
+        if len(row) >= 6 and row[3]:
+            try:
+                locations.append({
+                    "name": row[3].strip(),
+                    "lat": float(row[4].strip()),
+                    "lng": float(row[5].strip()),
+                    "radius": int(row[6].strip()) if row[6].isdigit() else 500
+                })
+            except: continue
+    return config, locations
+
+_settings_cache = ttl_cache.ReadThroughCache("settings", _load_system_settings, SETTINGS_CACHE_TTL)
+
+def get_system_settings():
+    try: return _settings_cache.get()
     except: return {}, []
 
+_geofence = (None, None)   # (設定版本, GeofenceIndex)
+
+def get_geofence_index():
+    """依目前的打卡地點建立網格索引，設定更新後才重建"""
+    global _geofence
+    _, locations = get_system_settings()
+    version, index = _geofence
+    if index is None or version != _settings_cache.version:
+        index = geofence.GeofenceIndex(locations)
+        _geofence = (_settings_cache.version, index)
+    return index
+
+# --- 道親資料索引 ---
+# 整張表一次讀入記憶體：user_id -> {"row": 列號, "profile": {...}}
+def _parse_profile(user_id, row):
+    # 與 row_values 相同：去掉尾端空白儲存格
+    while row and row[-1] == '': row = row[:-1]
+    
+    # 取得身分並去除空白
+    role = str(row[4]).strip() if len(row) > 4 else "組員"
+    
+    return {
+        "user_id": user_id,
+        "name": row[1] if len(row) > 1 else "",
+        "hall": row[2] if len(row) > 2 else "",
+        "group": row[3] if len(row) > 3 else "",
+        "role": role,
+        "goal": row[5] if len(row) > 5 else "0",
+        "phone": row[7] if len(row) > 7 else "",
+        "meal": row[8] if len(row) > 8 else "素食"
+    }
+
+def _index_user_rows(directory, rows, first_row):
+    for i, row in enumerate(rows):
+        uid = row[0].strip() if row else ""
+        if uid:
+            directory["users"][uid] = {"row": first_row + i, "profile": _parse_profile(uid, row)}
+    directory["rows"] = max(directory["rows"], first_row + len(rows) - 1)
+
+def _load_user_directory():
+    with open_worksheet("道親資料") as sheet:
+        data = sheet.get_all_values()
+    directory = {"users": {}, "rows": len(data[:1])}
+    _index_user_rows(directory, data[1:], 2)
+    return directory
+
+_users_cache = ttl_cache.ReadThroughCache("users", _load_user_directory, USER_DIRECTORY_TTL)
+_users_lock = threading.Lock()
+
+def _refresh_user_directory_tail(directory):
+    """只讀取上次載入之後新增的列 (新道親註冊)"""
+    with _users_lock:
+        start = directory["rows"] + 1
+        with open_worksheet("道親資料") as sheet:
+            rows = sheet.get_values(f"A{start}:I")
+        if rows: _index_user_rows(directory, rows, start)
+
+def _lookup_user(user_id):
+    directory = _users_cache.get()
+    entry = directory["users"].get(user_id)
+    if entry is None:
+        _refresh_user_directory_tail(directory)
+        entry = directory["users"].get(user_id)
+    return entry
+
 # --- 功能區 ---
 def get_user_full_profile(user_id):
     try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("道親資料")
-        cell = sheet.find(user_id)
-        row = sheet.row_values(cell.row)
-        
-        # 取得身分並去除空白
-        role = str(row[4]).strip() if len(row) > 4 else "組員"
-        
-        return {
-            "user_id": user_id,
-            "name": row[1] if len(row) > 1 else "",
-            "hall": row[2] if len(row) > 2 else "",
-            "group": row[3] if len(row) > 3 else "",
-            "role": role,
-            "goal": row[5] if len(row) > 5 else "0",
-            "phone": row[7] if len(row) > 7 else "",
-            "meal": row[8] if len(row) > 8 else "素食"
-        }
+        entry = _lookup_user(user_id)
+        if entry is None: return {"error": "找不到資料"}
+        return dict(entry["profile"])
     except: return {"error": "找不到資料"}
 
+# --- 班程報名索引 ---
+# rows: 整張報名紀錄 (rows[n-1] 為第 n 列)
+# by_key: (user_id, 班程名稱) -> 列號；by_user: user_id -> [列號...]
+def _index_signups(index):
+    by_key, by_user = {}, {}
+    for i, r in enumerate(index["rows"][1:], start=2):
+        if len(r) > 8 and r[8]:
+            by_key[(r[8], r[2])] = i
+            by_user.setdefault(r[8], []).append(i)
+    index["by_key"], index["by_user"] = by_key, by_user
+
+def _load_signup_index():
+    with open_worksheet("班程報名紀錄") as sheet:
+        records = sheet.get_all_values()
+    index = {"rows": records, "tail_at": time.monotonic()}
+    _index_signups(index)
+    return index
+
+_signups_cache = ttl_cache.ReadThroughCache("signups", _load_signup_index, SIGNUP_INDEX_TTL)
+_signups_lock = threading.Lock()
+
+def _appended_row_number(response):
+    # append_row 回傳 {"updates": {"updatedRange": "'班程報名紀錄'!A12:I12", ...}}
+    try:
+        updated = response["updates"]["updatedRange"].split("!")[-1]
+        return int(re.search(r"\d+", updated).group())
+    except: return None
+
+def _signup_key(r):
+    return (r[8], r[2]) if len(r) > 8 else None
+
+def _refresh_signup_tail(max_age=0):
+    """
+    讀取上次載入之後新增的列 (其他 worker 寫入的報名)，呼叫時需持有 _signups_lock。
+    從最後一筆已知的列開始讀，若對不上表示其他 worker 刪除過列，改為整表重讀。
+    max_age > 0 時，距上次補讀未超過 max_age 秒就直接使用記憶體中的索引
+    """
+    index = _signups_cache.get()
+    if max_age and time.monotonic() - index["tail_at"] < max_age: return index
+    index["tail_at"] = time.monotonic()
+    rows = index["rows"]
+    start = max(len(rows), 1)
+    with open_worksheet("班程報名紀錄") as sheet:
+        tail = sheet.get_values(f"A{start}:I")
+    if rows:
+        if not tail or _signup_key(tail[0]) != _signup_key(rows[-1]):
+            return _signups_cache.refresh()
+        tail = tail[1:]
+    for i, r in enumerate(tail, start=len(rows) + 1):
+        rows.append(r)
+        if i > 1 and len(r) > 8 and r[8]:
+            index["by_key"][(r[8], r[2])] = i
+            index["by_user"].setdefault(r[8], []).append(i)
+    return index
+
 def register_class_signup(user_id, class_date, class_name, note):
     try:
         # 自動帶入個資
         profile = get_user_full_profile(user_id)
         if "error" in profile: return False, "請先至「個人設定」完善資料"
         
-        client = get_client()
-        wb = client.open("公堂壇務運作管理系統")
-        try: sheet = wb.worksheet("班程報名紀錄")
-        except: 
-            sheet = wb.add_worksheet("班程報名紀錄", 1000, 9)
-            sheet.append_row(["時間","日期","名稱","姓名","電話","午餐","晚餐","備註","ID"])
-            
-        # 檢查重複
-        records = sheet.get_all_values()
-        for row in records:
-            if len(row) > 8 and row[8] == user_id and row[2] == class_name:
+        with _signups_lock:
+            # 先補讀其他 worker 新增的報名，再檢查重複
+            index = _refresh_signup_tail()
+            # 檢查重複
+            if (user_id, class_name) in index["by_key"]:
                 return False, "已報名過此班程"
                 
-        # 寫入
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        meal = profile.get("meal", "素食")
-        row = [ts, class_date, class_name, profile['name'], profile['phone'], meal, meal, note, user_id]
-        sheet.append_row(row)
+            # 寫入
+            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            meal = profile.get("meal", "素食")
+            row = [ts, class_date, class_name, profile['name'], profile['phone'], meal, meal, note, user_id]
+            with open_worksheet("班程報名紀錄") as sheet:
+                response = sheet.append_row(row)
+            
+            row_num = _appended_row_number(response)
+            rows = index["rows"]
+            if row_num is None or row_num != len(rows) + 1:
+                # 其他 worker 也寫入了新列，索引已不完整，下次重新載入
+                _signups_cache.invalidate()
+            else:
+                rows.append(row)
+                index["by_key"][(user_id, class_name)] = row_num
+                index["by_user"].setdefault(user_id, []).append(row_num)
         return True, "報名成功"
     except Exception as e: return False, str(e)
 
 def cancel_class_signup(user_id, class_name):
     try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("班程報名紀錄")
-        records = sheet.get_all_values()
-        for i, r in enumerate(records):
-            if len(r) > 8 and r[8] == user_id and r[2] == class_name:
-                sheet.delete_rows(i+1)
-                return True, "已取消報名"
+        with _signups_lock:
+            for attempt in range(2):
+                index = _signups_cache.get()
+                row_num = index["by_key"].get((user_id, class_name))
+                if row_num is None: return False, "無此紀錄"
+                
+                with open_worksheet("班程報名紀錄") as sheet:
+                    # 刪除前確認該列仍是這筆報名 (其他 worker 刪除過會造成列號位移)
+                    r = sheet.row_values(row_num)
+                    if len(r) > 8 and r[8] == user_id and r[2] == class_name:
+                        sheet.delete_rows(row_num)
+                        del index["rows"][row_num - 1]
+                        _index_signups(index)
+                        return True, "已取消報名"
+                _signups_cache.refresh()
         return False, "無此紀錄"
     except Exception as e: return False, str(e)
 
 def get_my_signups(user_id):
     try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("班程報名紀錄")
-        records = sheet.get_all_values()
-        data = []
-        for r in records[1:]:
-            if len(r) > 8 and r[8] == user_id:
-                data.append({"date": r[1], "name": r[2]})
-        return data
+        with _signups_lock:
+            # 只是列出報名：與了愿統計相同，最多每 TAIL_READ_INTERVAL 秒補讀一次
+            index = _refresh_signup_tail(TAIL_READ_INTERVAL)
+        rows = index["rows"]
+        return [{"date": rows[n - 1][1], "name": rows[n - 1][2]} for n in index["by_user"].get(user_id, [])]
     except: return []
 
-def get_upcoming_classes():
-    try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("班程資訊")
+# --- 班程行事曆 (依日期排序，以 bisect 找出今天之後的班程) ---
+def _load_class_calendar():
+    with open_worksheet("班程資訊") as sheet:
         data = sheet.get_all_values()
-        res = []
-        today = datetime.now()
-        for r in data[1:]:
-            if len(r) >= 2:
-                try:
-                    c_date = datetime.strptime(r[0], "%Y/%m/%d")
-                    if c_date >= today: res.append({"date": r[0], "name": r[1]})
-                except: continue
-        return res
+    entries = []
+    for r in data[1:]:
+        if len(r) >= 2:
+            try: entries.append((datetime.strptime(r[0], "%Y/%m/%d"), {"date": r[0], "name": r[1]}))
+            except: continue
+    entries.sort(key=lambda e: e[0])
+    return {"dates": [e[0] for e in entries], "classes": [e[1] for e in entries]}
+
+_calendar_cache = ttl_cache.ReadThroughCache("classes", _load_class_calendar, CALENDAR_CACHE_TTL)
+
+def get_upcoming_classes(offset=0, limit=None):
+    try:
+        calendar = _calendar_cache.get()
+        start = bisect.bisect_left(calendar["dates"], datetime.now()) + offset
+        end = None if limit is None else start + limit
+        return calendar["classes"][start:end]
     except: return []
 
 # --- 雜項支援 ---
-def get_all_categories():
-    try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("了愿項目")
+def _load_categories():
+    with open_worksheet("了愿項目") as sheet:
         return sheet.col_values(1)
+
+_categories_cache = ttl_cache.ReadThroughCache("categories", _load_categories, CATEGORIES_CACHE_TTL)
+
+def get_all_categories():
+    try: return list(_categories_cache.get())
     except: return []
 
 def get_button_config(): return [] # 預留
 def get_class_result_links(): return [] # 預留
 
+# --- 了愿統計 (每人總數 / 每月 / 每項目) ---
+# 啟動後從打卡紀錄建一次，之後每次打卡直接累加；
+# 查詢時再補讀其他 worker 新增的列 (以打卡 ID 去重，不會重複計算)
+def _new_checkin_stats():
+    return {"seen": set(), "total": Counter(), "by_month": {}, "by_category": {}, "rows": 0, "tail_at": time.monotonic()}
+
+def _count_checkin(stats, row):
+    # row: [ID, user_id, 時間, 姓名, 項目, 備註]
+    if len(row) < 5 or not row[1]: return
+    rid, uid, ts, category = row[0], row[1], row[2], row[4]
+    if rid:
+        if rid in stats["seen"]: return
+        stats["seen"].add(rid)
+    stats["total"][uid] += 1
+    stats["by_month"].setdefault(uid, Counter())[ts[:7]] += 1
+    stats["by_category"].setdefault(uid, Counter())[category] += 1
+
+def _load_checkin_stats():
+    with open_worksheet("了愿打卡紀錄") as sheet:
+        data = sheet.get_all_values()
+    stats = _new_checkin_stats()
+    for row in data: _count_checkin(stats, row)
+    stats["rows"] = len(data)
+    # 尚在日誌中、還沒寫進試算表的打卡也要算進去
+    for row in write_journal.pending_rows("了愿打卡紀錄"): _count_checkin(stats, row)
+    return stats
+
+_checkin_stats_cache = ttl_cache.ReadThroughCache("checkin_stats", _load_checkin_stats, CHECKIN_STATS_TTL)
+_checkin_stats_lock = threading.Lock()
+_checkin_tail_lock = threading.Lock()
+
+def _record_checkin(row):
+    # 尚未建立統計時不必在這裡觸發整表讀取，之後建立時會一併讀到這筆
+    stats = _checkin_stats_cache.peek()
+    if stats is None: return
+    try:
+        with _checkin_stats_lock: _count_checkin(stats, row)
+    except Exception as e:
+        print(f"⚠️ 了愿統計更新失敗: {e}")
+
+def _refresh_checkin_tail(stats):
+    """
+    補讀上次載入之後新增的列，以及日誌中尚未寫入的打卡 (日誌檔由同一台機器的 worker 共用)。
+    每個 worker 最多每 TAIL_READ_INTERVAL 秒讀一次；已有其他執行緒在讀時直接回傳記憶體中的數字
+    """
+    if time.monotonic() - stats["tail_at"] < TAIL_READ_INTERVAL: return
+    if not _checkin_tail_lock.acquire(blocking=False): return
+    try:
+        if time.monotonic() - stats["tail_at"] < TAIL_READ_INTERVAL: return
+        # 讀取失敗也等下一個間隔再試，不讓每個請求都重試
+        stats["tail_at"] = time.monotonic()
+        start = stats["rows"] + 1
+        with open_worksheet("了愿打卡紀錄") as sheet:
+            rows = sheet.get_values(f"A{start}:F")
+        pending = write_journal.pending_rows("了愿打卡紀錄")
+        with _checkin_stats_lock:
+            for row in rows: _count_checkin(stats, row)
+            for row in pending: _count_checkin(stats, row)
+            stats["rows"] = max(stats["rows"], start + len(rows) - 1)
+    finally:
+        _checkin_tail_lock.release()
+
+def get_checkin_counts(user_id, month=None):
+    """回傳 (總次數, 指定月份次數, 各項目次數)，month 格式為 YYYY-MM，預設本月"""
+    stats = _checkin_stats_cache.get()
+    try:
+        _refresh_checkin_tail(stats)
+    except Exception as e:
+        print(f"⚠️ 了愿統計補讀失敗，沿用目前資料: {e}")
+    month = month or datetime.now().strftime("%Y-%m")
+    return (
+        stats["total"].get(user_id, 0),
+        stats["by_month"].get(user_id, {}).get(month, 0),
+        dict(stats["by_category"].get(user_id, {}))
+    )
+
 def get_dashboard_data(user_id):
     p = get_user_full_profile(user_id)
     if "error" in p: return p
-    # 簡單計算
     p['target'] = int(p['goal']) if p['goal'].isdigit() else 0
-    p['actual'] = 0 # 這裡可加入讀取打卡紀錄邏輯
+    try:
+        p['total'], p['actual'], p['by_category'] = get_checkin_counts(user_id)
+    except:
+        p['total'], p['actual'], p['by_category'] = 0, 0, {}
     return p
 
+def _verified_user_entry(sheet, user_id):
+    """
+    寫入前確認索引中的列號仍屬於此使用者：
+    管理員排序 / 刪除 / 插入列後列號會變動，此時重新載入索引再確認一次
+    """
+    for attempt in range(2):
+        entry = _lookup_user(user_id)
+        if entry is None: return None
+        cell = sheet.get_values(f"A{entry['row']}")
+        if cell and cell[0] and str(cell[0][0]).strip() == user_id: return entry
+        if attempt == 0:
+            print("⚠️ 道親資料列號已變動，重新載入索引")
+            _users_cache.refresh()
+    return None
+
 def update_user_goal(user_id, goal):
     try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("道親資料")
-        cell = sheet.find(user_id)
-        sheet.update_cell(cell.row, 6, goal)
+        with batch_cells("道親資料") as batch:
+            entry = _verified_user_entry(batch.sheet, user_id)
+            if entry is None: return False
+            batch.set(entry["row"], 6, goal)
+        entry["profile"]["goal"] = str(goal)
         return True
     except: return False
 
 def update_user_profile(user_id, phone, meal, goal):
     try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("道親資料")
-        cell = sheet.find(user_id)
-        if phone: sheet.update_cell(cell.row, 8, phone)
-        if meal: sheet.update_cell(cell.row, 9, meal)
-        if goal: sheet.update_cell(cell.row, 6, goal)
+        with batch_cells("道親資料") as batch:
+            entry = _verified_user_entry(batch.sheet, user_id)
+            if entry is None: return False, "找不到資料"
+            row = entry["row"]
+            if phone: batch.set(row, 8, phone)
+            if meal: batch.set(row, 9, meal)
+            if goal: batch.set(row, 6, goal)
+        # 同步更新記憶體中的資料
+        profile = entry["profile"]
+        if phone: profile["phone"] = str(phone)
+        if meal: profile["meal"] = str(meal)
+        if goal: profile["goal"] = str(goal)
         return True, "更新成功"
     except Exception as e: return False, str(e)
 
+# --- 新增資料 (先寫入本機日誌，背景批次同步) ---
+def _append_rows(name, rows):
+    """日誌同步用：一次 values_append 寫入多列"""
+    with open_worksheet(name):
+        wb = get_spreadsheet()
+        wb.values_append("'%s'!A1" % name.replace("'", "''"), {'valueInputOption': 'RAW'}, {'values': rows})
+
+def _existing_row_ids(name):
+    with open_worksheet(name) as sheet:
+        return set(sheet.col_values(1))
+
+write_journal.configure(_append_rows, _existing_row_ids)
+
+def _journal_append(name, row):
+    try:
+        write_journal.append(name, row)
+    except Exception as e:
+        # 本機日誌無法使用時，退回同步寫入
+        print(f"⚠️ 寫入日誌失敗，改為直接寫入試算表: {e}")
+        with open_worksheet(name) as sheet:
+            sheet.append_row(row)
+
 def append_checkin_data(user_id, user_name, category, note):
     try:
-        client = get_client()
-        try: sheet = client.open("公堂壇務運作管理系統").worksheet("了愿打卡紀錄")
-        except: sheet = client.open("公堂壇務運作管理系統").add_worksheet("了愿打卡紀錄", 1000, 6)
-        
         rid = str(uuid.uuid4())
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        sheet.append_row([rid, user_id, ts, user_name, category, note])
+        row = [rid, user_id, ts, user_name, category, note]
+        _journal_append("了愿打卡紀錄", row)
+        _record_checkin(row)
         return True, "打卡成功"
     except Exception as e: return False, str(e)
 
 def append_fix_report(user_id, user_name, hall, item, desc, display_url, record_url=None):
     try:
-        client = get_client()
-        try: sheet = client.open("公堂壇務運作管理系統").worksheet("故障申報紀錄")
-        except: sheet = client.open("公堂壇務運作管理系統").add_worksheet("故障申報紀錄", 100, 8)
-        
         rid = str(uuid.uuid4())
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         item_full = f"【{hall}】{item}" if hall else item
         
         # 寫入
-        sheet.append_row([rid, ts, user_name, item_full, desc, display_url, "待處理", record_url or display_url])
+        _journal_append("故障申報紀錄", [rid, ts, user_name, item_full, desc, display_url, "待處理", record_url or display_url])
         
-        # 嘗試發送 TG
+        # 發送 TG (背景外送匣，不等待 Telegram 回應)
         try:
-            telegram_handler.send_message(f"🛠 報修通知: {user_name} - {item_full}")
+            # 通知以 HTML 模式送出，使用者輸入的 < & 需跳脫
+            telegram_handler.notify(f"🛠 報修通知: {html.escape(str(user_name))} - {html.escape(str(item_full))}")
         except: pass
             
         return True, "申報成功"
@@ -221,30 +642,137 @@ def get_group_duties(group_name):
     # 這裡放回您原本的輪值邏輯
     return {"tasks": []} 
 
+# --- 臨時任務認領帳本 ---
+# 認領先記在所有 worker 共用的 claim_ledger (SQLite，不會超過需求人數)，
+# 再由背景執行緒把累積的人數批次寫回「臨時任務」表
+def _task_number(v):
+    try: return int(str(v).strip())
+    except: return 0
+
+def _load_public_tasks():
+    from gspread.utils import numericise
+    # 記錄開始讀取的時間：比這更晚的寫回，帳本中的人數還沒包含
+    loaded_at = time.time()
+    with open_worksheet("臨時任務") as sheet:
+        data = sheet.get_all_values()
+    if not data: return {"tasks": {}, "id_col": 1, "count_col": 5, "needed_col": 4, "loaded_at": loaded_at}
+    header = [h.strip() for h in data[0]]
+    col = lambda name, default: header.index(name) if name in header else default
+    c_id, c_name, c_desc = col('ID', 0), col('任務名稱', 1), col('說明', 2)
+    c_needed, c_count, c_status = col('需求人數', 3), col('目前人數', 4), col('狀態', 5)
+    tasks = {}
+    for i, r in enumerate(data[1:], start=2):
+        r = r + [''] * (len(header) - len(r))
+        if not r[c_id]: continue
+        tasks[str(r[c_id]).strip()] = {
+            "row": i,
+            "id": numericise(r[c_id]),
+            "name": r[c_name],
+            "desc": r[c_desc],
+            "needed": _task_number(r[c_needed]),
+            "current": _task_number(r[c_count]),
+            "status": str(r[c_status]),
+        }
+    return {"tasks": tasks, "id_col": c_id + 1, "count_col": c_count + 1, "needed_col": c_needed + 1, "loaded_at": loaded_at}
+
+_tasks_cache = ttl_cache.ReadThroughCache("tasks", _load_public_tasks, TASKS_CACHE_TTL)
+_reconcile_wakeup = threading.Event()
+_reconciler = None
+_reconciler_pid = None
+_reconciler_lock = threading.Lock()
+
 def get_public_tasks():
     try:
-        client = get_client()
-        sheet = client.open("公堂壇務運作管理系統").worksheet("臨時任務")
-        data = sheet.get_all_records()
+        ledger = _tasks_cache.get()
+        tasks = ledger["tasks"]
+        counts = claim_ledger.claimed_counts(tasks, ledger["loaded_at"])
         res = []
-        for r in data:
-            if str(r['狀態']) == 'Open' and r['目前人數'] < r['需求人數']:
-                res.append({"id": r['ID'], "name": r['任務名稱'], "desc": r['說明'], "needed": r['需求人數'], "current": r['目前人數']})
+        for tid, t in tasks.items():
+            current = counts[tid]
+            if t['status'] == 'Open' and current < t['needed']:
+                res.append({"id": t['id'], "name": t['name'], "desc": t['desc'], "needed": t['needed'], "current": current})
         return res
     except: return []
 
 def claim_public_task(user_id, task_id, task_name):
     try:
-        client = get_client()
-        wb = client.open("公堂壇務運作管理系統")
-        sheet = wb.worksheet("臨時任務")
-        cell = sheet.find(str(task_id))
-        cur = int(sheet.cell(cell.row, 5).value)
-        sheet.update_cell(cell.row, 5, cur + 1)
+        task_id = str(task_id).strip()
+        ledger = _tasks_cache.get()
+        task = ledger["tasks"].get(task_id)
+        if task is None: return False, "找不到此任務"
+        if task['status'] != 'Open': return False, "此任務已關閉"
+        if not claim_ledger.reserve(task_id, task["current"], task["needed"], ledger["loaded_at"]):
+            return False, "此任務人數已滿"
+        start_task_reconciler()
+        _reconcile_wakeup.set()
         append_checkin_data(user_id, "自動", "臨時了愿", f"認領: {task_name}")
         return True, "認領成功"
     except Exception as e: return False, str(e)
 
+def start_task_reconciler():
+    """啟動寫回執行緒 (每個 worker 一個；其他 worker 留下未寫回的認領也會由它寫回)"""
+    global _reconciler, _reconciler_pid
+    if _reconciler_pid == os.getpid() and _reconciler.is_alive(): return
+    with _reconciler_lock:
+        if _reconciler_pid == os.getpid() and _reconciler.is_alive(): return
+        _reconciler = threading.Thread(target=_reconcile_loop, name="task-reconciler", daemon=True)
+        _reconciler.start()
+        _reconciler_pid = os.getpid()
+
+def _reconcile_loop():
+    while True:
+        _reconcile_wakeup.wait(TASK_RECONCILE_INTERVAL)
+        _reconcile_wakeup.clear()
+        # 稍等一下，讓同一波認領合併成一次寫入
+        time.sleep(1)
+        try:
+            reconcile_task_claims()
+        except Exception as e:
+            print(f"⚠️ 臨時任務人數寫回失敗，稍後重試: {e}")
+
+def reconcile_task_claims():
+    """把所有 worker 累積的認領數寫回試算表：一次 batch_get 讀取最新人數，一次 batch_update 寫入"""
+    moved = []
+    claim_ledger.reconcile(lambda pending: _write_task_claims(pending, moved))
+    if moved:
+        print("⚠️ 臨時任務列號已變動，重新載入後再寫回")
+        _tasks_cache.refresh()
+
+def _write_task_claims(pending, moved):
+    from gspread.utils import rowcol_to_a1
+    ledger = _tasks_cache.get()
+    tasks = ledger["tasks"]
+    # 任務已從表上移除，認領數無處可寫
+    dropped = [tid for tid in pending if tid not in tasks]
+    items = [(tid, tasks[tid], n) for tid, n in pending.items() if tid in tasks]
+    synced = {}
+    if not items: return synced, dropped
+    id_col, count_col, needed_col = ledger["id_col"], ledger["count_col"], ledger["needed_col"]
+    ranges = []
+    for _, t, _ in items:
+        ranges.append(rowcol_to_a1(t["row"], id_col))
+        ranges.append(rowcol_to_a1(t["row"], count_col))
+        ranges.append(rowcol_to_a1(t["row"], needed_col))
+
+    with batch_cells("臨時任務") as batch:
+        values = batch.sheet.batch_get(ranges)
+        cell = lambda vr: vr[0][0] if vr and vr[0] else ''
+        for i, (tid, t, n) in enumerate(items):
+            # 有人在表上插入 / 刪除列時列號會變動，這筆留待重新載入後再寫
+            if str(cell(values[3 * i])).strip() != tid:
+                moved.append(tid)
+                continue
+            fresh = _task_number(cell(values[3 * i + 1]))
+            needed = _task_number(cell(values[3 * i + 2]))
+            # 依表上最新的需求人數設上限 (例如管理員調低了需求人數)，超出的認領不寫入
+            total = min(fresh + n, max(needed, fresh))
+            if total < fresh + n:
+                print(f"⚠️ 臨時任務 {tid} 認領超過需求人數 {needed}，{fresh + n - total} 筆認領未計入")
+            if total != fresh: batch.set(t["row"], count_col, total)
+            t["current"] = total
+            synced[tid] = total
+    return synced, dropped
+
 def add_task_by_leader(user_id, name):
     # 權限檢查邏輯
     p = get_user_full_profile(user_id)
@@ -1,39 +1,160 @@
 import requests
 import os
+import queue
+import threading
+import time
+
+# ==========================================
+#  通知外送匣 (outbox)
+#  notify() 只把訊息放進佇列就返回，由背景執行緒負責送出：
+#  - 共用同一個 Session (keep-alive)
+#  - 短時間內的多則通知合併成一則摘要
+#  - 遵守 Telegram 頻率限制 (群組約每分鐘 20 則)，429 時依 retry_after 等待
+# ==========================================
+
+# 收到第一則通知後等待多久，把同一波的通知合併送出 (秒)
+COALESCE_WINDOW = float(os.getenv('TELEGRAM_COALESCE_WINDOW', 3))
+# 兩次送出之間的最短間隔 (秒)
+MIN_SEND_INTERVAL = float(os.getenv('TELEGRAM_MIN_INTERVAL', 3))
+MAX_RETRIES = 5
+MAX_BACKOFF = 60
+# Telegram 單則訊息長度上限
+MAX_MESSAGE_LENGTH = 4096
+
+_session = requests.Session()
+_outbox = queue.Queue(maxsize=1000)
+_worker = None
+_worker_pid = None
+_start_lock = threading.Lock()
+_last_sent_at = 0.0
 
 
 def send_message(text):
     """
-    發送訊息到指定的 Telegram 群組
+    發送訊息到指定的 Telegram 群組 (同步送出，成功回傳 True)
     :param text: 要發送的訊息內容 (支援 HTML 格式)
     """
     try:
-        # 直接從環境變數讀取，避免循環引用 config.py
-        token = os.getenv('TELEGRAM_BOT_TOKEN')
-        chat_id = os.getenv('TELEGRAM_CHAT_ID')
+        return _send_with_retry(text)
+    except Exception as e:
+        print(f"❌ Telegram 模組發生錯誤: {e}")
+        return False
+
+
+def notify(text):
+    """非同步送出通知：放入外送匣後立即返回，不影響使用者請求的回應時間"""
+    # 直接從環境變數讀取，避免循環引用 config.py
+    # 如果沒有設定，則安靜地跳過 (不報錯，方便本地測試)
+    if not os.getenv('TELEGRAM_BOT_TOKEN') or not os.getenv('TELEGRAM_CHAT_ID'):
+        return
+    _start()
+    try:
+        _outbox.put_nowait(text)
+    except queue.Full:
+        print("⚠️ Telegram 外送匣已滿，捨棄通知")
+
+
+def _start():
+    global _worker, _worker_pid
+    if _worker_pid == os.getpid() and _worker.is_alive(): return
+    with _start_lock:
+        if _worker_pid == os.getpid() and _worker.is_alive(): return
+        _worker = threading.Thread(target=_run, name="telegram-outbox", daemon=True)
+        _worker.start()
+        _worker_pid = os.getpid()
 
-        # 如果沒有設定，則安靜地跳過 (不報錯，方便本地測試)
-        if not token or not chat_id:
-            # print("⚠️ Telegram 設定缺失，跳過發送通知。")
-            return
 
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+def _run():
+    while True:
+        messages = [_outbox.get()]
+        # 等待一小段時間，把接連而來的通知合併
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            try:
+                messages.append(_outbox.get(timeout=remaining))
+            except queue.Empty:
+                break
+        for text, members in _build_digests(messages):
+            try:
+                if _send_with_retry(text) or len(members) == 1: continue
+                # 摘要被 Telegram 拒絕 (例如其中一則的 HTML 有誤)：逐則重送，只有出問題的那則會遺失
+                print("⚠️ Telegram 摘要被拒，改為逐則送出")
+                for member in members: _send_with_retry(member)
+            except Exception as e:
+                print(f"❌ Telegram 通知送出失敗，已放棄: {e}")
 
-        # 設定發送參數
-        payload = {
-            "chat_id": chat_id,
-            "text": text,
-            "parse_mode": "HTML",  # 啟用 HTML 格式 (可使用 <b>粗體</b>, <a href>連結</a>)
-            "disable_web_page_preview": False  # 允許連結預覽 (方便看照片)
-        }
 
-        # 發送請求
-        response = requests.post(url, json=payload, timeout=5)
+def _build_digests(messages):
+    """把多則通知合併成摘要，回傳 [(摘要內容, 其中的原始通知), ...]"""
+    if len(messages) == 1: return [(messages[0], messages)]
+    header = f"📬 共 {len(messages)} 則通知\n"
+    digests, current, members = [], header, []
+    for text in messages:
+        line = text + "\n"
+        if len(current) + len(line) > MAX_MESSAGE_LENGTH and members:
+            digests.append((current.rstrip(), members))
+            current, members = header, []
+        current += line
+        members.append(text)
+    digests.append((current.rstrip(), members))
+    return digests
+
+
+def _send_with_retry(text):
+    global _last_sent_at
+    # 直接從環境變數讀取，避免循環引用 config.py
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    chat_id = os.getenv('TELEGRAM_CHAT_ID')
+
+    # 如果沒有設定，則安靜地跳過 (不報錯，方便本地測試)
+    if not token or not chat_id:
+        # print("⚠️ Telegram 設定缺失，跳過發送通知。")
+        return False
+
+    url = f"https://api.telegram.org/bot{token}/sendMessage"
+
+    # 設定發送參數
+    payload = {
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": "HTML",  # 啟用 HTML 格式 (可使用 <b>粗體</b>, <a href>連結</a>)
+        "disable_web_page_preview": False  # 允許連結預覽 (方便看照片)
+    }
+
+    for attempt in range(MAX_RETRIES):
+        wait = _last_sent_at + MIN_SEND_INTERVAL - time.monotonic()
+        if wait > 0: time.sleep(wait)
+
+        try:
+            response = _session.post(url, json=payload, timeout=5)
+        except requests.RequestException as e:
+            delay = min(MAX_BACKOFF, 2 ** attempt)
+            print(f"⚠️ Telegram 連線失敗，{delay} 秒後重試: {e}")
+            time.sleep(delay)
+            continue
+        finally:
+            _last_sent_at = time.monotonic()
 
         if response.status_code == 200:
             print("✅ Telegram 通知發送成功")
-        else:
-            print(f"❌ Telegram 發送失敗: {response.text}")
+            return True
+        if response.status_code == 429:
+            try:
+                delay = response.json().get("parameters", {}).get("retry_after", 5)
+            except ValueError:
+                delay = 5
+            print(f"⚠️ Telegram 頻率限制，{delay} 秒後重試")
+            time.sleep(delay)
+            continue
+        if response.status_code >= 500:
+            time.sleep(min(MAX_BACKOFF, 2 ** attempt))
+            continue
 
-    except Exception as e:
-        print(f"❌ Telegram 模組發生錯誤: {e}")
\ No newline at end of file
+        # 4xx (格式錯誤等) 重試也不會成功
+        print(f"❌ Telegram 發送失敗: {response.text}")
+        return False
+
+    # 與 4xx 區分：暫時性錯誤重試用完時不再逐則重送
+    raise Exception("Telegram 重試次數已用完")
@@ -0,0 +1,180 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# 所有具名快取，供管理端點統一清除 / 重新載入
+_registry = {}
+_MISSING = object()
+
+# 跨 worker 的重新載入通知：每個快取一個標記檔，refresh() 時更新其 mtime，
+# 各 worker 在 get() 時發現標記比自己載入時新，就同步重新載入
+CACHE_MARKER_DIR = os.getenv('CACHE_MARKER_DIR', os.path.join(tempfile.gettempdir(), 'huilingong_cache'))
+
+
+def _marker_path(name):
+    return os.path.join(CACHE_MARKER_DIR, f"{name}.gen")
+
+
+def _shared_generation(name):
+    try:
+        return os.stat(_marker_path(name)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _bump_generation(name):
+    """更新標記檔 mtime (保證遞增)，回傳新的世代值"""
+    os.makedirs(CACHE_MARKER_DIR, exist_ok=True)
+    path = _marker_path(name)
+    generation = max(time.time_ns(), _shared_generation(name) + 1)
+    with open(path, 'a'):
+        pass
+    os.utime(path, ns=(generation, generation))
+    return _shared_generation(name)
+
+
+class ReadThroughCache:
+    """
+    單一值的 read-through 快取 (stale-while-revalidate)：
+    - 第一次讀取時同步載入
+    - 超過 TTL 後仍先回傳舊值，同時由背景執行緒重新載入
+    - 背景載入失敗時保留舊值，下一個 TTL 再試
+    - 其他 worker 呼叫 ttl_cache.refresh() 後，下一次 get() 同步重新載入
+    """
+
+    def __init__(self, name, loader, ttl):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.version = 0
+        self._value = _MISSING
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._generation = _shared_generation(name)
+        _registry[name] = self
+
+    def get(self):
+        if self._value is _MISSING:
+            with self._load_lock:
+                if self._value is _MISSING:
+                    self._store(self.loader())
+            return self._value
+        self.sync()
+        if time.monotonic() - self._loaded_at > self.ttl:
+            self._refresh_in_background()
+        return self._value
+
+    def sync(self):
+        """其他 worker 已要求重新載入時，在此同步載入；失敗則沿用舊值"""
+        if self._value is _MISSING: return
+        generation = _shared_generation(self.name)
+        if generation <= self._generation: return
+        with self._lock:
+            if generation <= self._generation: return
+            self._generation = generation
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"⚠️ 快取 [{self.name}] 重新載入失敗，沿用舊資料: {e}")
+
+    def peek(self):
+        """回傳目前的值 (尚未載入則回傳 None)，不觸發載入"""
+        return None if self._value is _MISSING else self._value
+
+    def refresh(self):
+        """同步重新載入 (由管理端點呼叫，讓使用者請求不必等待)"""
+        with self._load_lock:
+            self._store(self.loader())
+        return self._value
+
+    def invalidate(self):
+        """丟棄目前的值，下一次 get() 會同步重新載入"""
+        with self._load_lock:
+            self._value = _MISSING
+
+    def _store(self, value):
+        self._value = value
+        self._loaded_at = time.monotonic()
+        self.version += 1
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            with self._load_lock:
+                self._store(self.loader())
+        except Exception as e:
+            print(f"⚠️ 快取 [{self.name}] 背景更新失敗，沿用舊資料: {e}")
+            # 延後下一次重試，避免每個請求都觸發一次載入
+            self._loaded_at = time.monotonic()
+        finally:
+            self._refreshing = False
+
+
+class LRUCache:
+    """有容量上限的 LRU 快取，每筆資料另有 TTL"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_cache(name):
+    return _registry.get(name)
+
+
+def refresh(name=None):
+    """
+    重新載入指定 (或全部) 快取，並通知同一台機器上的其他 worker 重新載入；
+    回傳本 worker 載入成功的名稱清單 (失敗的快取保留舊值)
+    """
+    names = [name] if name else list(_registry)
+    done = []
+    for n in names:
+        cache = _registry.get(n)
+        if cache is None: continue
+        try:
+            cache._generation = _bump_generation(n)
+        except OSError as e:
+            print(f"⚠️ 快取 [{n}] 無法通知其他 worker: {e}")
+        try:
+            cache.refresh()
+            done.append(n)
+        except Exception as e:
+            print(f"⚠️ 快取 [{n}] 重新載入失敗，沿用舊資料: {e}")
+    return done
@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# ==========================================
+#  Webhook 背景處理
+#  /callback 驗證簽章後把事件丟進有上限的佇列立即回 200，
+#  由背景 worker 執行打卡、寫入與回覆。
+#  每個 worker 有自己的佇列，事件依使用者分派：
+#  不同使用者的事件平行處理，同一使用者的訊息維持先後順序。
+#  佇列滿時放進該佇列的溢出區，由同一個 worker 依序處理，不會亂序。
+# ==========================================
+
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 200))
+# LINE reply token 約一分鐘內有效，超過就無法回覆
+REPLY_TOKEN_TTL = 60
+
+_queues = [queue.Queue(maxsize=max(1, WEBHOOK_QUEUE_SIZE // WEBHOOK_WORKERS)) for _ in range(WEBHOOK_WORKERS)]
+# 佇列滿時的溢出區 (每個佇列一個)：只由該佇列的 worker 依序搬回，維持同一使用者的順序
+_overflows = [deque() for _ in _queues]
+_shard_locks = [threading.Lock() for _ in _queues]
+_handler = None
+_workers = []
+_workers_pid = None
+_start_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    "enqueued": 0,
+    "processed": 0,
+    "failed": 0,
+    "overflow": 0,      # 佇列已滿，先放進溢出區
+    "expired": 0,       # 開始處理時 reply token 已過期
+    "last_lag": 0.0,
+    "max_lag": 0.0,
+}
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def start(handler):
+    """啟動 worker (每個 process 各自啟動，fork 後才建立執行緒)"""
+    global _handler, _workers, _workers_pid
+    _handler = handler
+    if _workers_pid == os.getpid(): return
+    with _start_lock:
+        if _workers_pid == os.getpid(): return
+        _workers = []
+        for i in range(len(_queues)):
+            t = threading.Thread(target=_worker, args=(i,), name=f"webhook-{i}", daemon=True)
+            t.start()
+            _workers.append(t)
+        _workers_pid = os.getpid()
+
+
+def _event_key(event):
+    source = getattr(event, 'source', None)
+    for attr in ('user_id', 'group_id', 'room_id'):
+        key = getattr(source, attr, None)
+        if key: return key
+    return ''
+
+
+def _shard_for(event):
+    # 同一使用者固定進同一個佇列 (同一個 worker)，確保處理順序
+    return hash(_event_key(event)) % len(_queues)
+
+
+def submit(events, handler):
+    start(handler)
+    for event in events:
+        i = _shard_for(event)
+        item = (time.monotonic(), event)
+        with _shard_locks[i]:
+            # 溢出區還有資料時新事件也排在後面，不能插隊進佇列
+            if not _overflows[i]:
+                try:
+                    _queues[i].put_nowait(item)
+                    _count("enqueued")
+                    continue
+                except queue.Full:
+                    pass
+            # 背壓：不阻塞 /callback，也不在請求中處理 (會與佇列中較早的事件同時執行)
+            _overflows[i].append(item)
+            _count("overflow")
+
+
+def _refill(i):
+    # 佇列有空位時，把溢出區的事件依序搬回佇列尾端
+    with _shard_locks[i]:
+        while _overflows[i] and not _queues[i].full():
+            _queues[i].put_nowait(_overflows[i].popleft())
+
+
+def _worker(i):
+    q = _queues[i]
+    while True:
+        enqueued_at, event = q.get()
+        _refill(i)
+        try:
+            _process(enqueued_at, event)
+        finally:
+            q.task_done()
+
+
+def _process(enqueued_at, event):
+    lag = time.monotonic() - enqueued_at
+    with _stats_lock:
+        _stats["last_lag"] = lag
+        _stats["max_lag"] = max(_stats["max_lag"], lag)
+        if lag > REPLY_TOKEN_TTL: _stats["expired"] += 1
+    try:
+        _handler(event)
+        _count("processed")
+    except Exception as e:
+        _count("failed")
+        print(f"❌ Webhook 事件處理失敗: {e}")
+
+
+def stats():
+    with _stats_lock:
+        data = dict(_stats)
+    data["queue_depth"] = sum(q.qsize() for q in _queues) + sum(len(o) for o in _overflows)
+    data["overflow_depth"] = sum(len(o) for o in _overflows)
+    data["queue_depth_per_worker"] = [q.qsize() for q in _queues]
+    data["queue_size"] = WEBHOOK_QUEUE_SIZE
+    data["workers"] = sum(1 for t in _workers if t.is_alive())
+    return data
@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ==========================================
+#  寫入日誌 (write-behind journal)
+#  打卡 / 報修等新增資料先寫入本機 SQLite 立即回應，
+#  再由背景執行緒批次 values_append 到 Google Sheets。
+#  每列第一欄為唯一 row id，重送前會比對試算表避免重複寫入。
+# ==========================================
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+JOURNAL_PATH = os.getenv('WRITE_JOURNAL_PATH', os.path.join(BASE_DIR, 'write_journal.db'))
+# 背景寫入間隔 (秒)；有新資料時會提早喚醒
+FLUSH_INTERVAL = float(os.getenv('JOURNAL_FLUSH_INTERVAL', 5))
+# 喚醒後再等一小段時間，把同一波的資料合併成一批
+BATCH_WINDOW = float(os.getenv('JOURNAL_BATCH_WINDOW', 0.5))
+BATCH_SIZE = int(os.getenv('JOURNAL_BATCH_SIZE', 200))
+# 送出中的資料超過此秒數未完成，視為結果不明，需比對後重送
+SEND_LEASE = 120
+MAX_BACKOFF = 60
+
+_sender = None          # sender(sheet_name, rows)：批次寫入試算表
+_existing_ids = None    # existing_ids(sheet_name) -> set：試算表中已存在的 row id
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_flusher = None
+_flusher_pid = None
+
+
+def configure(sender, existing_ids):
+    global _sender, _existing_ids
+    _sender = sender
+    _existing_ids = existing_ids
+
+
+def _connect():
+    conn = sqlite3.connect(JOURNAL_PATH, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _init_db():
+    conn = _connect()
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                sheet TEXT NOT NULL,
+                row_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                claimed_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_status ON journal (status, seq)")
+    finally:
+        conn.close()
+
+
+def append(sheet_name, row):
+    """將一列資料寫入日誌 (row[0] 必須是唯一 row id)，寫入後立即返回"""
+    start()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO journal (sheet, row_id, payload, created_at) VALUES (?, ?, ?, ?)",
+            (sheet_name, str(row[0]), json.dumps(row, ensure_ascii=False), time.time())
+        )
+    finally:
+        conn.close()
+    _wakeup.set()
+
+
+def start():
+    """啟動背景寫入執行緒 (每個 worker process 各一個，fork 後才會啟動)"""
+    global _flusher, _flusher_pid
+    if _flusher is not None and _flusher.is_alive() and _flusher_pid == os.getpid():
+        return
+    with _start_lock:
+        if _flusher is not None and _flusher.is_alive() and _flusher_pid == os.getpid():
+            return
+        _init_db()
+        _flusher_pid = os.getpid()
+        _flusher = threading.Thread(target=_run, name="write-journal", daemon=True)
+        _flusher.start()
+
+
+def pending_count():
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def pending_rows(sheet_name):
+    """尚未寫入試算表的資料 (依寫入順序)"""
+    if not os.path.exists(JOURNAL_PATH): return []
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT payload FROM journal WHERE sheet=? ORDER BY seq", (sheet_name,)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+    return [json.loads(r[0]) for r in rows]
+
+
+def _run():
+    failures = 0
+    while True:
+        delay = FLUSH_INTERVAL if failures == 0 else min(MAX_BACKOFF, 2 ** failures)
+        if _wakeup.wait(delay) and failures == 0:
+            time.sleep(BATCH_WINDOW)
+        _wakeup.clear()
+        try:
+            while flush_once():
+                pass
+            failures = 0
+        except Exception as e:
+            failures += 1
+            print(f"⚠️ 寫入日誌同步失敗 (第 {failures} 次)，稍後重試: {e}")
+
+
+def _claim(conn, where, params):
+    # BEGIN IMMEDIATE 確保多個 worker 不會領到同一批資料
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            f"SELECT seq, sheet, row_id, payload FROM journal WHERE {where} ORDER BY seq LIMIT ?",
+            params + (BATCH_SIZE,)
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE journal SET status='sending', claimed_at=?, attempts=attempts+1 WHERE seq=?",
+                [(time.time(), r[0]) for r in rows]
+            )
+        conn.execute("COMMIT")
+        return rows
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _recover_uncertain(conn):
+    """處理送出後結果不明的資料：已在試算表中的視為完成，其餘退回待送"""
+    rows = _claim(conn, "status='sending' AND claimed_at < ?", (time.time() - SEND_LEASE,))
+    by_sheet = {}
+    for seq, sheet, row_id, _ in rows:
+        by_sheet.setdefault(sheet, []).append((seq, row_id))
+    for sheet, items in by_sheet.items():
+        try:
+            existing = _existing_ids(sheet)
+        except Exception:
+            # 無法比對就維持結果不明，下次再試
+            conn.executemany("UPDATE journal SET claimed_at=0 WHERE seq=?", [(seq,) for seq, _ in items])
+            raise
+        done = [(seq,) for seq, row_id in items if row_id in existing]
+        retry = [(seq,) for seq, row_id in items if row_id not in existing]
+        conn.executemany("DELETE FROM journal WHERE seq=?", done)
+        conn.executemany("UPDATE journal SET status='pending', claimed_at=NULL WHERE seq=?", retry)
+
+
+def flush_once():
+    """送出一批待寫入資料，回傳是否還有可能有剩餘資料"""
+    if _sender is None: return False
+    conn = _connect()
+    try:
+        _recover_uncertain(conn)
+        rows = _claim(conn, "status='pending'", ())
+        if not rows: return False
+
+        # 依 seq 順序分組，同一張表內維持寫入順序
+        by_sheet = {}
+        for seq, sheet, row_id, payload in rows:
+            by_sheet.setdefault(sheet, []).append((seq, json.loads(payload)))
+
+        for sheet, items in by_sheet.items():
+            seqs = [(seq,) for seq, _ in items]
+            try:
+                _sender(sheet, [row for _, row in items])
+            except Exception:
+                # 可能已部分寫入：標記為結果不明，下一輪比對 row id 後再重送
+                conn.executemany("UPDATE journal SET claimed_at=0 WHERE seq=?", seqs)
+                others = [(seq,) for s, its in by_sheet.items() if s != sheet for seq, _ in its]
+                conn.executemany(
+                    "UPDATE journal SET status='pending', claimed_at=NULL WHERE seq=? AND status='sending' AND claimed_at > 0",
+                    others
+                )
+                raise
+            conn.executemany("DELETE FROM journal WHERE seq=?", seqs)
+            print(f"✅ 已批次寫入 {len(items)} 筆至「{sheet}」")
+        return len(rows) >= BATCH_SIZE
+    finally:
+        conn.close()
@@ -1,14 +1,13 @@
 # wsgi.py
-from main import init_full_application
+from main import app
 
-# 呼叫 main.py 裡面的共用初始化函式
+# 匯入 main.py 時即執行共用初始化函式 init_full_application()
+# (不再重複呼叫一次，避免每個 worker 初始化兩遍)
 # 這會執行：
 # 1. 載入 Settings (從環境變數)
 # 2. 初始化 LINE Bot (解決機器人不回話的問題)
-# 3. 更新 Rich Menu (圖文選單)
+# 3. 更新 Rich Menu (圖文選單；只由搶到啟動鎖的 worker 在背景執行)
 # 4. 回傳 app 給 Render 的 Gunicorn 使用
 
-app, _ = init_full_application()
-
 if __name__ == "__main__":
     app.run()
\ No newline at end of file